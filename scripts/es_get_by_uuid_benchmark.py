@@ -0,0 +1,88 @@
+'''
+Compare ways of fetching a document by uuid from elasticsearch when there
+is one index per item type: a term query on uuid over all indices (the
+previous ElasticSearchStorage.get_by_uuid), an ids query over all indices
+and a get from the item type's index.
+
+A throwaway cluster stand in is created with --indices indices of --docs
+documents each, all prefixed with --prefix, and deleted afterwards.
+
+Usage: bin/py scripts/es_get_by_uuid_benchmark.py --host localhost:9200
+'''
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+import argparse
+import random
+import time
+import uuid
+
+
+def make_indices(es, prefix, indices, docs):
+    names = ['%s%d' % (prefix, n) for n in range(indices)]
+    uuids = {}
+    for name in names:
+        es.indices.create(index=name, body={'settings': {'number_of_shards': 5}})
+        uuids[name] = [str(uuid.uuid4()) for i in range(docs)]
+        bulk(es, (
+            {
+                '_index': name,
+                '_type': name,
+                '_id': doc_uuid,
+                '_source': {'uuid': doc_uuid, 'item_type': name, 'embedded': {'title': doc_uuid}},
+            }
+            for doc_uuid in uuids[name]
+        ))
+    es.indices.refresh(index=prefix + '*')
+    return uuids
+
+
+def term_search(es, prefix, name, doc_uuid):
+    query = {'query': {'term': {'uuid': doc_uuid}}, 'version': True}
+    return es.search(index=prefix + '*', body=query, size=1)['hits']['hits'][0]
+
+
+def ids_search(es, prefix, name, doc_uuid):
+    query = {'query': {'ids': {'values': [doc_uuid]}}, 'version': True}
+    return es.search(index=prefix + '*', body=query, size=1)['hits']['hits'][0]
+
+
+def routed_get(es, prefix, name, doc_uuid):
+    return es.get(index=name, doc_type=name, id=doc_uuid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='localhost:9200')
+    parser.add_argument('--prefix', default='get-by-uuid-benchmark-')
+    parser.add_argument('--indices', type=int, default=20)
+    parser.add_argument('--docs', type=int, default=1000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    es = Elasticsearch([args.host])
+    uuids = make_indices(es, args.prefix, args.indices, args.docs)
+    try:
+        lookups = [
+            (name, random.choice(uuids[name]))
+            for name in random.sample(list(uuids) * args.lookups, args.lookups)
+        ]
+        for func in [term_search, ids_search, routed_get]:
+            timings = []
+            for name, doc_uuid in lookups:
+                start = time.time()
+                hit = func(es, args.prefix, name, doc_uuid)
+                timings.append(time.time() - start)
+                assert hit['_id'] == doc_uuid and hit['_version']
+            timings.sort()
+            print('%-12s median %.2f ms  p95 %.2f ms' % (
+                func.__name__,
+                timings[len(timings) // 2] * 1e3,
+                timings[int(len(timings) * .95)] * 1e3,
+            ))
+    finally:
+        es.indices.delete(index=args.prefix + '*')
+
+
+if __name__ == '__main__':
+    main()
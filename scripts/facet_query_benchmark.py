@@ -0,0 +1,91 @@
+'''
+Compare the facet aggregations built by set_facets with the previous layout,
+where every facet repeated the principals, type and shared filters.
+
+For each type with facets, both queries are sent to elasticsearch with size 0
+and the request body size and ES took time are reported. Load the snowflakes
+test inserts (e.g. with dev-servers) first.
+
+Usage: bin/py scripts/facet_query_benchmark.py development.ini --app-name app
+'''
+
+from pyramid import paster
+from snovault import TYPES
+from snovault.elasticsearch import ELASTIC_SEARCH
+from snowflakes.search import (
+    audit_facets,
+    build_aggregation,
+    facet_filter,
+    set_facets,
+)
+import argparse
+import json
+
+
+def legacy_facets(facets, used_filters, principals, doc_types):
+    aggs = {}
+    for facet_name, facet_options in facets:
+        query_filters = {
+            'must': [
+                {'terms': {'principals_allowed.view': principals}},
+                {'terms': {'embedded.@type': doc_types}},
+            ],
+            'must_not': [],
+        }
+        for field, terms in used_filters.items():
+            if field.rstrip('!') == facet_name:
+                continue
+            occur, clause = facet_filter(field, terms)
+            query_filters[occur].append(clause)
+        agg_name, agg = build_aggregation(facet_name, facet_options)
+        aggs[agg_name] = {
+            'aggs': {agg_name: agg},
+            'filter': {'bool': query_filters},
+        }
+    return aggs
+
+
+def run_query(es, index, aggs, repeat):
+    body = {'query': {'match_all': {}}, 'aggs': aggs}
+    took = []
+    for i in range(repeat):
+        res = es.search(index=index, body=body, size=0, request_cache=False)
+        took.append(res['took'])
+    return len(json.dumps(body)), sorted(took)[len(took) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('config_uri')
+    parser.add_argument('--app-name', default='app')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--filter', action='append', default=[],
+                        help='field=value filter applied to every query')
+    args = parser.parse_args()
+
+    app = paster.get_app(args.config_uri, args.app_name)
+    types = app.registry[TYPES]
+    es = app.registry[ELASTIC_SEARCH]
+    principals = ['system.Everyone', 'group.admin']
+    used_filters = {}
+    for item in args.filter:
+        field, value = item.split('=', 1)
+        used_filters.setdefault(field, []).append(value)
+
+    print('%-20s %12s %12s %10s %10s' % ('type', 'old bytes', 'new bytes', 'old ms', 'new ms'))
+    for name, ti in sorted(types.by_item_type.items()):
+        if 'facets' not in ti.schema:
+            continue
+        facets = [('type', {'title': 'Data Type'})]
+        facets.extend(ti.schema['facets'].items())
+        facets.extend(audit_facets)
+        doc_types = [ti.name]
+        old_size, old_took = run_query(
+            es, name, legacy_facets(facets, used_filters, principals, doc_types), args.repeat)
+        new_size, new_took = run_query(
+            es, name, set_facets(facets, used_filters, principals, doc_types), args.repeat)
+        print('%-20s %12d %12d %10d %10d' % (ti.name, old_size, new_size, old_took, new_took))
+
+
+if __name__ == '__main__':
+    main()
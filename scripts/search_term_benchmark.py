@@ -0,0 +1,77 @@
+'''
+Time prepare_search_term's translation of search terms, parsing every term
+with antlr versus the plain word fast path and memoized translation.
+
+Terms are read one per line from the given files (e.g. searchTerm values
+extracted from access logs), or a small built in sample is used.
+
+Usage: bin/py scripts/search_term_benchmark.py [terms.txt ...]
+'''
+
+from snowflakes.search import translate_search_term
+import argparse
+import time
+
+
+SAMPLE_TERMS = [
+    'snowball',
+    'snow ball',
+    'ENCSR000AAA',
+    'Stanford',
+    'J. Michael Cherry',
+    'lab:j-michael-cherry',
+    '@type:Snowflake',
+    'snow AND ball',
+    'snow OR flake',
+    'status:released',
+    'date_created:[2015-01-01 TO 2016-01-01]',
+    'a7a1f1e8-1b0c-4b48-9d2c-1b8a7b1d2c3f',
+    'snow*',
+    '"snow ball"',
+]
+
+
+def parse_all(terms):
+    translate = translate_search_term.__wrapped__
+    for term in terms:
+        # Bypass the fast path by forcing a parse
+        translate(term + ' AND parse')
+
+
+def translate_all(terms):
+    for term in terms:
+        translate_search_term(term)
+
+
+def timeit(func, terms, repeat):
+    start = time.time()
+    for i in range(repeat):
+        func(terms)
+    return (time.time() - start) / (repeat * len(terms)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    terms = []
+    for filename in args.files:
+        with open(filename) as f:
+            terms.extend(line.strip() for line in f if line.strip())
+    if not terms:
+        terms = SAMPLE_TERMS
+
+    start = time.time()
+    translate_search_term.__wrapped__('import AND antlr')
+    print('antlr import and first parse: %.1f ms' % ((time.time() - start) * 1e3))
+    print('parsed: %.1f us per term' % timeit(parse_all, terms, args.repeat))
+    translate_search_term.cache_clear()
+    print('first translation: %.1f us per term' % timeit(translate_all, terms, 1))
+    print('memoized: %.1f us per term' % timeit(translate_all, terms, args.repeat))
+    print(translate_search_term.cache_info())
+
+
+if __name__ == '__main__':
+    main()
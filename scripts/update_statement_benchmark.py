@@ -0,0 +1,116 @@
+'''
+Count the SQL statements RDBStorage.update issues when an item's links and
+unique keys change, compared with the previous per row updates.
+
+An item with --links links and --keys unique keys is created, then updated
+so that half of each are replaced. Everything is rolled back at the end.
+
+Usage: bin/py scripts/update_statement_benchmark.py postgresql:///snowflakes
+'''
+
+from snovault.storage import (
+    Base,
+    Key,
+    Link,
+    RDBStorage,
+    Resource,
+)
+from sqlalchemy import (
+    create_engine,
+    event,
+)
+from sqlalchemy.orm import sessionmaker
+import argparse
+import uuid
+
+
+class LegacyRDBStorage(RDBStorage):
+    ''' RDBStorage.update as it was, with one statement per changed row
+    '''
+    def update(self, model, properties=None, sheets=None, unique_keys=None, links=None):
+        session = self.DBSession()
+        session.add(model)
+        self._update_properties(model, properties, sheets)
+        if links is not None:
+            self._update_rels(model, links)
+        if unique_keys is not None:
+            self._update_keys(model, unique_keys)
+        session.flush()
+
+    def _update_keys(self, model, unique_keys):
+        session = self.DBSession()
+        keys_set = {(k, v) for k, values in unique_keys.items() for v in values}
+        existing = {(key.name, key.value) for key in model.unique_keys}
+        for pk in existing - keys_set:
+            session.delete(session.query(Key).get(pk))
+        for name, value in keys_set - existing:
+            session.add(Key(rid=model.rid, name=name, value=value))
+
+    def _update_rels(self, model, links):
+        session = self.DBSession()
+        source = model.rid
+        rels = {(k, uuid.UUID(target)) for k, targets in links.items() for target in targets}
+        existing = {(link.rel, link.target_rid) for link in model.rels}
+        for rel, target in existing - rels:
+            session.delete(session.query(Link).get((source, rel, target)))
+        for rel, target in rels - existing:
+            session.add(Link(source_rid=source, rel=rel, target_rid=target))
+
+
+def run(storage, session, counter, n_links, n_keys, prefix):
+    targets = [Resource('benchmark_item', {'': {}}) for i in range(n_links * 2)]
+    session.add_all(targets)
+    session.flush()
+    target_ids = [str(target.rid) for target in targets]
+
+    model = Resource('benchmark_item')
+    keys = ['%s%d' % (prefix, i) for i in range(n_keys * 2)]
+    storage.update(model, {}, unique_keys={'benchmark:key': keys[:n_keys]},
+                   links={'parts': target_ids[:n_links]})
+    session.flush()
+    model = session.query(Resource).get(model.rid)
+    session.expire_all()
+
+    counter[0] = 0
+    half_links = n_links // 2
+    half_keys = n_keys // 2
+    storage.update(
+        model, {},
+        unique_keys={'benchmark:key': keys[half_keys:n_keys + half_keys]},
+        links={'parts': target_ids[half_links:n_links + half_links]},
+    )
+    session.flush()
+    return counter[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('sqlalchemy_url')
+    parser.add_argument('--links', type=int, default=200)
+    parser.add_argument('--keys', type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(args.sqlalchemy_url)
+    counter = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter[0] += 1
+
+    connection = engine.connect()
+    tx = connection.begin()
+    try:
+        Base.metadata.create_all(connection)
+        session = sessionmaker(bind=connection)()
+        for name, cls in [('before', LegacyRDBStorage), ('after', RDBStorage)]:
+            storage = cls(lambda: session)
+            statements = run(storage, session, counter, args.links, args.keys, name)
+            print('%-6s %d statements to replace %d of %d links and %d of %d keys' % (
+                name, statements, args.links // 2, args.links, args.keys // 2, args.keys))
+    finally:
+        tx.rollback()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
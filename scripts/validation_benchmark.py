@@ -0,0 +1,64 @@
+'''
+Compare schema validation throughput for the snowflakes test inserts when a
+new SchemaValidator is built for every document and when the type's cached
+validator is reused.
+
+Links are resolved against the app's database, so load the test inserts
+(e.g. with dev-servers) first. Validation errors are ignored.
+
+Usage: bin/py scripts/validation_benchmark.py development.ini --app-name app
+'''
+
+from pkg_resources import resource_filename
+from pyramid import paster
+from pyramid.scripting import prepare
+from snovault import TYPES
+from snovault.schema_utils import validate
+import argparse
+import json
+import os
+import time
+
+
+def timeit(type_info, items, repeat, cached):
+    validator = type_info.schema_validator if cached else None
+    start = time.time()
+    for i in range(repeat):
+        for item in items:
+            validate(type_info.schema, item, validator=validator)
+    return (time.time() - start) / (repeat * len(items)) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('config_uri')
+    parser.add_argument('--app-name', default='app')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    app = paster.get_app(args.config_uri, args.app_name)
+    env = prepare(registry=app.registry)
+    request = env['request']
+    request.root = request.context = env['root']
+    request.datastore = 'database'
+    types = app.registry[TYPES]
+    inserts = resource_filename('snowflakes', 'tests/data/inserts/')
+
+    print('%-20s %8s %12s %12s' % ('type', 'items', 'new ms', 'cached ms'))
+    try:
+        for filename in sorted(os.listdir(inserts)):
+            name, ext = os.path.splitext(filename)
+            if ext != '.json' or name not in types:
+                continue
+            with open(os.path.join(inserts, filename)) as f:
+                items = json.load(f)
+            type_info = types[name]
+            new = timeit(type_info, items, args.repeat, cached=False)
+            cached = timeit(type_info, items, args.repeat, cached=True)
+            print('%-20s %8d %12.3f %12.3f' % (type_info.name, len(items), new, cached))
+    finally:
+        env['closer']()
+
+
+if __name__ == '__main__':
+    main()
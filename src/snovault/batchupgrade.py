@@ -70,11 +70,13 @@ def update_item(storage, context):
     if target_version is None or current_version == target_version:
         unique_keys = context.unique_keys(properties)
         links = context.links(properties)
-        keys_add, keys_remove = storage._update_keys(context.model, unique_keys)
+        keys_add, keys_remove = storage._diff_keys(context.model, unique_keys)
         if keys_add or keys_remove:
+            storage._update_keys(context.model, keys_add, keys_remove)
             update = True
-        rels_add, rels_remove = storage._update_rels(context.model, links)
+        rels_add, rels_remove = storage._diff_rels(context.model, links)
         if rels_add or rels_remove:
+            storage._update_rels(context.model, rels_add, rels_remove)
             update = True
     else:
         properties = deepcopy(properties)
@@ -86,7 +88,8 @@ def update_item(storage, context):
             del properties['schema_version']
         schema = context.type_info.schema
         properties['uuid'] = str(context.uuid)
-        validated, errors = validate(schema, properties, properties)
+        validated, errors = validate(
+            schema, properties, properties, context.type_info.schema_validator)
         # Do not send modification events to skip indexing
         context.update(validated)
         update = True
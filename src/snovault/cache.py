@@ -1,17 +1,224 @@
+from collections import (
+    OrderedDict,
+    defaultdict,
+)
 from pyramid.threadlocal import manager
-from sqlalchemy.util import LRUCache
+from .util import get_root_request
+import sys
+import threading
 import transaction.interfaces
 from zope.interface import implementer
 
 
+def approx_size(value):
+    """ Approximate resident size in bytes of a JSON like value.
+
+    Only containers are followed, other objects count as their shallow size.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += approx_size(k) + approx_size(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for v in value:
+            size += approx_size(v)
+    return size
+
+
+class SizedLRUCache(object):
+    """ Least recently used cache bounded by entry count and approximate bytes.
+
+    A limit of 0 means unbounded. ``sizeof`` is called once per stored value.
+    ``on_evict(key, value)`` is called for entries removed to make room.
+    """
+    def __init__(self, max_entries=0, max_bytes=0, sizeof=approx_size, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            value, size = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """ Get without counting a hit or changing the eviction order.
+        """
+        try:
+            return self.entries[key][0]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        self.entries[key] = (value, size)
+        self.bytes += size
+        self.evict()
+
+    def pop(self, key, default=None):
+        try:
+            value, size = self.entries.pop(key)
+        except KeyError:
+            return default
+        self.bytes -= size
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def over_limit(self, entries, size):
+        return (self.max_entries and entries > self.max_entries) or \
+            (self.max_bytes and size > self.max_bytes)
+
+    def evict(self):
+        while self.entries and self.over_limit(len(self.entries), self.bytes):
+            key, (value, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evicted(key, value)
+
+    def evicted(self, key, value):
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+
+class SizedTwoQueueCache(SizedLRUCache):
+    """ Scan resistant variant of SizedLRUCache (simplified 2Q).
+
+    New entries go into a FIFO queue allowed ``in_ratio`` of the limits.
+    Entries evicted from it are remembered by key only and are promoted to
+    the main LRU queue if stored again, so a single pass over many items
+    (e.g. a full reindex) cannot flush the frequently used ones.
+    """
+    def __init__(self, max_entries=0, max_bytes=0, sizeof=approx_size, on_evict=None,
+                 in_ratio=.25, ghost_entries=10000):
+        super(SizedTwoQueueCache, self).__init__(max_entries, max_bytes, sizeof, on_evict)
+        self.in_ratio = in_ratio
+        self.ghost_entries = ghost_entries
+        self.fifo = OrderedDict()
+        self.fifo_bytes = 0
+        self.ghosts = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries) + len(self.fifo)
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.fifo
+
+    def get(self, key, default=None):
+        try:
+            value, size = self.fifo[key]
+        except KeyError:
+            return super(SizedTwoQueueCache, self).get(key, default)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        try:
+            return self.fifo[key][0]
+        except KeyError:
+            return super(SizedTwoQueueCache, self).peek(key, default)
+
+    def __setitem__(self, key, value):
+        promote = key in self.entries or key in self.ghosts
+        self.pop(key)
+        self.ghosts.pop(key, None)
+        size = self.sizeof(value)
+        if promote:
+            self.entries[key] = (value, size)
+        else:
+            self.fifo[key] = (value, size)
+            self.fifo_bytes += size
+        self.bytes += size
+        self.evict()
+
+    def pop(self, key, default=None):
+        try:
+            value, size = self.fifo.pop(key)
+        except KeyError:
+            return super(SizedTwoQueueCache, self).pop(key, default)
+        self.fifo_bytes -= size
+        self.bytes -= size
+        return value
+
+    def clear(self):
+        super(SizedTwoQueueCache, self).clear()
+        self.fifo.clear()
+        self.fifo_bytes = 0
+        self.ghosts.clear()
+
+    def evict(self):
+        while len(self) and self.over_limit(len(self), self.bytes):
+            fifo_full = (self.max_entries and len(self.fifo) > self.max_entries * self.in_ratio) or \
+                (self.max_bytes and self.fifo_bytes > self.max_bytes * self.in_ratio)
+            if self.fifo and (fifo_full or not self.entries):
+                key, (value, size) = self.fifo.popitem(last=False)
+                self.fifo_bytes -= size
+                self.ghosts[key] = None
+                while len(self.ghosts) > self.ghost_entries:
+                    self.ghosts.popitem(last=False)
+            else:
+                key, (value, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evicted(key, value)
+
+
+CACHE_POLICIES = {
+    'lru': SizedLRUCache,
+    '2q': SizedTwoQueueCache,
+}
+
+
+def make_cache(policy='lru', **kw):
+    try:
+        factory = CACHE_POLICIES[policy]
+    except KeyError:
+        raise ValueError('Unknown cache policy: %r' % policy)
+    return factory(**kw)
+
+
 @implementer(transaction.interfaces.ISynchronizer)
-class ManagerLRUCache(object):
-    """ Override capacity in settings.
+class ManagerCache(object):
+    """ Per transaction cache. Override limits and policy in settings.
+
+    ``<name>.capacity`` bounds the number of entries, ``<name>.max_bytes``
+    their approximate size and ``<name>.policy`` selects ``lru`` or ``2q``.
+    Hits, misses, evictions and resident bytes are added to the root
+    request's stats as ``<short name>_hits`` etc. when the transaction ends.
     """
-    def __init__(self, name, default_capacity=100, threshold=.5):
+    def __init__(self, name, default_capacity=100, default_max_bytes=0,
+                 default_policy='lru', sizeof=approx_size):
         self.name = name
+        self.stats_name = name.rsplit('.', 1)[-1]
         self.default_capacity = default_capacity
-        self.threshold = threshold
+        self.default_max_bytes = default_max_bytes
+        self.default_policy = default_policy
+        self.sizeof = sizeof
         transaction.manager.registerSynch(self)
 
     @property
@@ -20,19 +227,20 @@ class ManagerLRUCache(object):
             return None
         threadlocals = manager.stack[0]
         if self.name not in threadlocals:
-            registry = threadlocals['registry']
-            capacity = int(registry.settings.get(self.name + '.capacity', self.default_capacity))
-            threadlocals[self.name] = LRUCache(capacity, self.threshold)
+            settings = threadlocals['registry'].settings
+            threadlocals[self.name] = make_cache(
+                settings.get(self.name + '.policy', self.default_policy),
+                max_entries=int(settings.get(self.name + '.capacity', self.default_capacity)),
+                max_bytes=int(settings.get(self.name + '.max_bytes', self.default_max_bytes)),
+                sizeof=self.sizeof,
+            )
         return threadlocals[self.name]
 
     def get(self, key, default=None):
         cache = self.cache
         if cache is None:
             return default
-        try:
-            return cache[key]
-        except KeyError:
-            return default
+        return cache.get(key, default)
 
     def __contains__(self, key):
         cache = self.cache
@@ -44,7 +252,18 @@ class ManagerLRUCache(object):
         cache = self.cache
         if cache is None:
             return
-        self.cache[key] = value
+        cache[key] = value
+
+    def record_stats(self, cache):
+        request = get_root_request()
+        if request is None:
+            return
+        stats = request._stats
+        for name in ('hits', 'misses', 'evictions'):
+            key = '%s_%s' % (self.stats_name, name)
+            stats[key] = stats.get(key, 0) + getattr(cache, name)
+        key = self.stats_name + '_bytes'
+        stats[key] = max(stats.get(key, 0), cache.bytes)
 
     # ISynchronizer
 
@@ -55,7 +274,125 @@ class ManagerLRUCache(object):
         # Ensure cache is cleared for retried transactions
         if manager.stack:
             threadlocals = manager.stack[0]
-            threadlocals.pop(self.name, None)
+            cache = threadlocals.pop(self.name, None)
+            if cache is not None:
+                self.record_stats(cache)
 
     def newTransaction(self, transaction):
         pass
+
+
+# Backwards compatible name
+ManagerLRUCache = ManagerCache
+
+
+class PersistentEmbedCache(object):
+    """ Process wide cache of rendered embeds.
+
+    Entries outlive the transaction. Each one records the tid of every uuid
+    embedded or linked while rendering and is only returned while all of
+    those tids are unchanged. Entries are also dropped by ``invalidate``,
+    which the indexer calls with the uuids it is about to reindex so that
+    changes not reflected in a tid (new reverse links) are caught.
+
+    ``shared`` may be set to a mapping, e.g. a multiprocessing manager dict,
+    which is consulted on local misses and written through on stores.
+    """
+    stats_prefix = 'persistent_embed_cache'
+
+    def __init__(self, capacity=2000, shared_capacity=100000, max_bytes=0, policy='lru'):
+        self.capacity = capacity
+        self.shared_capacity = shared_capacity
+        self.shared = None
+        self.entries = make_cache(
+            policy, max_entries=capacity, max_bytes=max_bytes, on_evict=self._evicted)
+        self.dependents = defaultdict(set)
+        self.lock = threading.RLock()
+
+    def record(self, name, value=1):
+        request = get_root_request()
+        if request is None:
+            return
+        key = '%s_%s' % (self.stats_prefix, name)
+        request._stats[key] = request._stats.get(key, 0) + value
+
+    def _lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        with self.lock:
+            old = self.entries.peek(key)
+            if old is not None:
+                self._forget(key, old)
+            for uuid, tid in entry[3]:
+                self.dependents[uuid].add(key)
+            self.entries[key] = entry
+
+    def _evicted(self, key, entry):
+        self._forget(key, entry)
+        self.record('evictions')
+
+    def _discard(self, key):
+        entry = self.entries.pop(key)
+        if entry is not None:
+            self._forget(key, entry)
+
+    def _forget(self, key, entry):
+        for uuid, tid in entry[3]:
+            keys = self.dependents.get(uuid)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[uuid]
+
+    def get(self, key, connection):
+        """ Returns (result, embedded, linked) or None if missing or stale.
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            self.record('misses')
+            return None
+        result, embedded, linked, tids = entry
+        for uuid, tid in tids:
+            item = connection.get_by_uuid(uuid)
+            if item is None or item.tid != tid:
+                with self.lock:
+                    self._discard(key)
+                self.record('misses')
+                return None
+        self.record('hits')
+        return result, embedded, linked
+
+    def set(self, key, value, connection):
+        result, embedded, linked = value
+        tids = []
+        for uuid in sorted(set(embedded).union(linked)):
+            item = connection.get_by_uuid(uuid)
+            if item is None:
+                return
+            tids.append((uuid, item.tid))
+        entry = (result, frozenset(embedded), frozenset(linked), tuple(tids))
+        self._store(key, entry)
+        if self.shared is not None and len(self.shared) < self.shared_capacity:
+            self.shared[key] = entry
+
+    def invalidate(self, uuids):
+        """ Drop local entries that depend on any of uuids.
+        """
+        with self.lock:
+            for uuid in uuids:
+                for key in list(self.dependents.get(str(uuid), ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dependents.clear()
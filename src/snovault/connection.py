@@ -1,7 +1,12 @@
 from past.builtins import basestring
 from pyramid.decorator import reify
+from pyramid.settings import asbool
 from uuid import UUID
-from .cache import ManagerLRUCache
+from .cache import (
+    ManagerCache,
+    PersistentEmbedCache,
+    approx_size,
+)
 from .interfaces import (
     CONNECTION,
     STORAGE,
@@ -17,15 +22,41 @@ class UnknownItemTypeError(Exception):
     pass
 
 
+def item_size(item):
+    ''' Approximate size of a cached item, dominated by its properties
+    '''
+    model = item.model
+    source = getattr(model, 'source', None)
+    if source is not None:
+        return approx_size(source)
+    return approx_size(model.properties)
+
+
 class Connection(object):
     ''' Intermediates between the storage and the rest of the system
     '''
     def __init__(self, registry):
         self.registry = registry
-        self.item_cache = ManagerLRUCache('snovault.connection.item_cache', 1000)
-        self.unique_key_cache = ManagerLRUCache('snovault.connection.key_cache', 1000)
-        embed_cache_capacity = int(registry.settings.get('embed_cache.capacity', 2000))
-        self.embed_cache = ManagerLRUCache('snovault.connection.embed_cache', embed_cache_capacity)
+        settings = registry.settings
+        self.item_cache = ManagerCache(
+            'snovault.connection.item_cache', 1000, 64 * 1024 * 1024, sizeof=item_size)
+        self.unique_key_cache = ManagerCache('snovault.connection.key_cache', 1000)
+        embed_cache_capacity = int(settings.get('embed_cache.capacity', 2000))
+        embed_cache_max_bytes = int(settings.get('embed_cache.max_bytes', 256 * 1024 * 1024))
+        embed_cache_policy = settings.get('embed_cache.policy', 'lru')
+        self.embed_cache = ManagerCache(
+            'snovault.connection.embed_cache', embed_cache_capacity,
+            embed_cache_max_bytes, embed_cache_policy)
+        # Optional cache of @@object / @@embedded results that outlives the transaction.
+        self.persistent_embed_cache = None
+        if asbool(settings.get('embed_cache.persistent', False)):
+            self.persistent_embed_cache = PersistentEmbedCache(
+                embed_cache_capacity,
+                int(settings.get('embed_cache.shared_capacity', 100000)),
+                embed_cache_max_bytes,
+                embed_cache_policy,
+            )
+
     @reify
     def storage(self):
         return self.registry[STORAGE]
@@ -34,7 +65,9 @@ class Connection(object):
     def types(self):
         return self.registry[TYPES]
 
-    def get_by_uuid(self, uuid, default=None):
+    def get_by_uuid(self, uuid, default=None, item_type=None):
+        ''' item_type, when known, lets the lookup go to that type's index
+        '''
         if isinstance(uuid, basestring):
             try:
                 uuid = UUID(uuid)
@@ -48,19 +81,11 @@ class Connection(object):
         if cached is not None:
             return cached
 
-        model = self.storage.get_by_uuid(uuid)
+        model = self.storage.get_by_uuid(uuid, item_type=item_type)
         if model is None:
             return default
 
-        try:
-            Item = self.types.by_item_type[model.item_type].factory
-        except KeyError:
-            raise UnknownItemTypeError(model.item_type)
-
-        item = Item(self.registry, model)
-        model.used_for(item)
-        self.item_cache[uuid] = item
-        return item
+        return self._cache_item(model)
 
     def get_by_unique_key(self, unique_key, name, default=None):
         pkey = (unique_key, name)
@@ -73,12 +98,77 @@ class Connection(object):
         if model is None:
             return default
 
-        uuid = model.uuid
+        uuid = str(model.uuid)
         self.unique_key_cache[pkey] = uuid
         cached = self.item_cache.get(uuid)
         if cached is not None:
             return cached
 
+        return self._cache_item(model)
+
+    def get_by_uuids(self, uuids, default=None):
+        ''' Items for uuids, in order, with default for those not found
+
+        Items not in the item cache are loaded from storage in one batch.
+        '''
+        keys = []
+        for uuid in uuids:
+            if isinstance(uuid, basestring):
+                try:
+                    uuid = UUID(uuid)
+                except ValueError:
+                    keys.append(None)
+                    continue
+            elif not isinstance(uuid, UUID):
+                raise TypeError(uuid)
+            keys.append(str(uuid))
+
+        items = {}
+        missing = []
+        for uuid in set(keys):
+            if uuid is None:
+                continue
+            cached = self.item_cache.get(uuid)
+            if cached is None:
+                missing.append(uuid)
+            else:
+                items[uuid] = cached
+        if missing:
+            for model in self.storage.get_by_uuids(missing):
+                items[str(model.uuid)] = self._cache_item(model)
+        return [items.get(uuid, default) for uuid in keys]
+
+    def get_by_unique_keys(self, pairs, default=None):
+        ''' Items for (unique_key, name) pairs, in order, with default for those not found
+
+        Keys not in the unique key cache are looked up in one batch.
+        '''
+        pairs = list(pairs)
+        uuids = {}
+        missing = []
+        for pkey in set(pairs):
+            cached = self.unique_key_cache.get(pkey)
+            if cached is None:
+                missing.append(pkey)
+            else:
+                uuids[pkey] = cached
+        items = {}
+        if missing:
+            for pkey, model in self.storage.get_by_unique_keys(missing).items():
+                uuid = uuids[pkey] = str(model.uuid)
+                self.unique_key_cache[pkey] = uuid
+                if uuid not in items:
+                    cached = self.item_cache.get(uuid)
+                    items[uuid] = cached if cached is not None else self._cache_item(model)
+        wanted = [uuid for uuid in set(uuids.values()) if uuid not in items]
+        items.update(zip(wanted, self.get_by_uuids(wanted)))
+        result = []
+        for pkey in pairs:
+            item = items.get(uuids.get(pkey))
+            result.append(default if item is None else item)
+        return result
+
+    def _cache_item(self, model):
         try:
             Item = self.types.by_item_type[model.item_type].factory
         except KeyError:
@@ -86,9 +176,30 @@ class Connection(object):
 
         item = Item(self.registry, model)
         model.used_for(item)
-        self.item_cache[uuid] = item
+        self.item_cache[str(model.uuid)] = item
         return item
 
+    def prefetch(self, uuids, links=True):
+        ''' Seed the item cache from the database for a batch of uuids
+
+        Resources (with their current property sheets) are loaded in a few
+        IN queries rather than one query per uuid. With ``links`` the first
+        hop of link targets is loaded as well.
+        '''
+        storage = self.storage.write
+        uuids = {str(uuid) for uuid in uuids}
+        wanted = [uuid for uuid in uuids if uuid not in self.item_cache]
+        models = storage.get_by_uuids(wanted)
+        if links:
+            targets = {str(rid) for rid in storage.get_link_targets(uuids)}
+            wanted = [
+                uuid for uuid in targets.difference(uuids)
+                if uuid not in self.item_cache
+            ]
+            models.extend(storage.get_by_uuids(wanted))
+        for model in models:
+            self._cache_item(model)
+
     def get_rev_links(self, model, rel, *types):
         item_types = [self.types[t].item_type for t in types]
         return self.storage.get_rev_links(model, rel, *item_types)
@@ -120,3 +231,6 @@ class Connection(object):
 
     def update(self, model, properties, sheets=None, unique_keys=None, links=None):
         self.storage.update(model, properties, sheets, unique_keys, links)
+
+    def create_many(self, records):
+        return self.storage.create_many(records)
@@ -1,4 +1,5 @@
 from past.builtins import basestring
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.settings import asbool
 from pyramid.traversal import (
     find_resource,
@@ -8,6 +9,7 @@ from uuid import (
     UUID,
     uuid4,
 )
+import json
 from .etag import if_match_tid
 from .interfaces import (
     COLLECTIONS,
@@ -20,6 +22,11 @@ from .resources import (
     Collection,
     Item,
 )
+from .schema_utils import (
+    collect_links,
+    prefetch_links,
+    validate,
+)
 from .validation import ValidationFailure
 from .validators import (
     no_validate_item_content_patch,
@@ -179,6 +186,101 @@ def collection_add(context, request, render=None):
     return result
 
 
+def bulk_items(request):
+    """ Items posted as a JSON array or as newline delimited JSON.
+
+    NDJSON lines that fail to parse are returned as ValueErrors so they are
+    reported against their line.
+    """
+    if request.content_type != 'application/x-ndjson':
+        items = request.json
+        if not isinstance(items, list):
+            raise HTTPBadRequest('Expected a JSON array of items')
+        return items
+    items = []
+    for line in request.body_file:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line.decode('utf-8')))
+        except ValueError as e:
+            items.append(e)
+    return items
+
+
+def bulk_error(exc):
+    if isinstance(exc, ValidationFailure):
+        return exc.detail
+    return {'location': 'body', 'name': [], 'description': str(exc)}
+
+
+@view_config(context=Collection, permission='add', request_method='POST', name='bulk')
+def collection_bulk_add(context, request):
+    """ Create many items in one request for high volume loaders.
+
+    Items are validated with a single schema validator and written together.
+    Items that fail validation or conflict are skipped and the response holds
+    a status for every item, in order. Nothing is rendered.
+    """
+    type_info = context.type_info
+    schema = type_info.schema
+    validator = type_info.schema_validator
+    items = bulk_items(request)
+    links = []
+    for data in items:
+        if isinstance(data, dict):
+            collect_links(schema, data, links)
+    if links:
+        prefetch_links(request, links)
+    results = []
+    pending = []
+    for data in items:
+        result = {'status': 'error'}
+        results.append(result)
+        if isinstance(data, ValueError):
+            result['errors'] = [bulk_error(data)]
+            continue
+        if not isinstance(data, dict):
+            result['errors'] = [bulk_error(ValueError('Expected a JSON object'))]
+            continue
+        validated, errors = validate(schema, data, validator=validator)
+        if errors:
+            result['errors'] = [
+                {'location': 'body', 'name': list(error.path), 'description': error.message}
+                for error in errors
+            ]
+            continue
+        item_properties, propname_children = split_child_props(type_info, validated)
+        if propname_children:
+            msg = 'Child items may not be created in bulk'
+            result['errors'] = [bulk_error(ValidationFailure('body', sorted(propname_children), msg))]
+            continue
+        if 'uuid' in item_properties:
+            uuid = UUID(item_properties.pop('uuid'))
+        else:
+            uuid = uuid4()
+        pending.append((result, uuid, item_properties))
+
+    created = type_info.factory.create_many(
+        request.registry, [(uuid, properties) for _, uuid, properties in pending])
+    for (result, _, _), item in zip(pending, created):
+        if isinstance(item, Exception):
+            result['errors'] = [bulk_error(item)]
+            continue
+        request.registry.notify(Created(item, request))
+        result['status'] = 'success'
+        result['uuid'] = str(item.uuid)
+
+    return {
+        'status': 'success',
+        '@type': ['result'],
+        'created': len([result for result in results if result['status'] == 'success']),
+        'errors': len([result for result in results if result['status'] == 'error']),
+        '@graph': results,
+    }
+
+
 @view_config(context=Item, permission='edit', request_method='PUT',
              validators=[validate_item_content_put], decorator=if_match_tid)
 @view_config(context=Item, permission='edit', request_method='PATCH',
@@ -11,6 +11,7 @@ from .interfaces import (
     APP_FACTORY,
     ELASTIC_SEARCH,
     INDEXER,
+    SEARCH_CACHE,
 )
 import json
 import sys
@@ -37,6 +38,7 @@ def includeme(config):
 
     config.include('.indexer')
     config.include('.indexer_state')
+    config.include('.search_cache')
     if asbool(settings.get('indexer')) and not PY2:
         config.include('.mpindexer')
 
@@ -80,23 +82,34 @@ class PyramidJSONSerializer(object):
 class TimedUrllib3HttpConnection(Urllib3HttpConnection):
     stats_count_key = 'es_count'
     stats_time_key = 'es_time'
+    stats_bytes_key = 'es_bytes'
+    stats_msearch_count_key = 'es_msearch_count'
+    stats_msearch_time_key = 'es_msearch_time'
 
-    def stats_record(self, duration):
+    def stats_record(self, duration, response=None, path=''):
         request = get_root_request()
         if request is None:
             return
 
         duration = int(duration * 1e6)
         stats = request._stats
-        stats[self.stats_count_key] = stats.get(self.stats_count_key, 0) + 1
-        stats[self.stats_time_key] = stats.get(self.stats_time_key, 0) + duration
+        if path.split('?', 1)[0].endswith('/_msearch'):
+            count_key = self.stats_msearch_count_key
+            time_key = self.stats_msearch_time_key
+        else:
+            count_key = self.stats_count_key
+            time_key = self.stats_time_key
+        stats[count_key] = stats.get(count_key, 0) + 1
+        stats[time_key] = stats.get(time_key, 0) + duration
+        if response is not None:
+            stats[self.stats_bytes_key] = stats.get(self.stats_bytes_key, 0) + len(response)
 
     def log_request_success(self, method, full_url, path, body, status_code, response, duration):
-        self.stats_record(duration)
+        self.stats_record(duration, response, path)
         return super(TimedUrllib3HttpConnection, self).log_request_success(
             method, full_url, path, body, status_code, response, duration)
 
     def log_request_fail(self, method, full_url, path, body, duration, status_code=None, response=None, exception=None):
-        self.stats_record(duration)
+        self.stats_record(duration, path=path)
         return super(TimedUrllib3HttpConnection, self).log_request_fail(
             method, full_url, path, body, duration, status_code, response, exception)
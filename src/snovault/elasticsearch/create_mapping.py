@@ -306,6 +306,11 @@ def es_mapping(mapping):
                 'type': 'keyword',
                 'include_in_all': False,
             },
+            'index_hash': {
+                'type': 'keyword',
+                'index': False,
+                'include_in_all': False,
+            },
             'item_type': {
                 'type': 'keyword',
             },
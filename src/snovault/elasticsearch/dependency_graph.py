@@ -0,0 +1,78 @@
+from pyramid.decorator import reify
+from snovault import DBSESSION
+from snovault.storage import IndexDependency
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class DependencyGraph(object):
+    ''' Reverse dependency index of indexed documents, kept in Postgres
+
+    The indexer records the embedded_uuids and linked_uuids of every document
+    it renders. Changed uuids are then mapped to the documents that must be
+    reindexed with batched queries, however many uuids have changed.
+
+    Indexer transactions are read only, so the graph is written and read
+    through its own connections. Pass bind to use another engine or
+    connection instead of the one the DBSession is bound to.
+    '''
+    def __init__(self, registry, batchsize=1000, bind=None):
+        self.registry = registry
+        self.batchsize = batchsize
+        if bind is not None:
+            self.engine = bind
+
+    @reify
+    def engine(self):
+        return self.registry[DBSESSION].bind
+
+    @reify
+    def table(self):
+        return IndexDependency.__table__
+
+    def _batches(self, values):
+        values = list(values)
+        for start in range(0, len(values), self.batchsize):
+            yield values[start:start + self.batchsize]
+
+    def update(self, records):
+        ''' Replace the dependencies of each (uuid, embedded_uuids, linked_uuids)
+        '''
+        records = list(records)
+        if not records:
+            return
+        table = self.table
+        with self.engine.begin() as connection:
+            for batch in self._batches(records):
+                sources = [str(uuid) for uuid, embedded, linked in batch]
+                connection.execute(table.delete().where(table.c.source.in_(sources)))
+                rows = []
+                for uuid, embedded, linked in batch:
+                    rows.extend(
+                        {'source': str(uuid), 'rel': 'embedded', 'target': str(target)}
+                        for target in set(embedded)
+                    )
+                    rows.extend(
+                        {'source': str(uuid), 'rel': 'linked', 'target': str(target)}
+                        for target in set(linked)
+                    )
+                if rows:
+                    connection.execute(table.insert(), rows)
+
+    def dependents(self, updated, renamed):
+        ''' Set of uuids embedding any of updated or linking to any of renamed
+        '''
+        table = self.table
+        related = set()
+        with self.engine.connect() as connection:
+            for rel, targets in (('embedded', updated), ('linked', renamed)):
+                for batch in self._batches(str(uuid) for uuid in targets):
+                    query = table.select().with_only_columns([table.c.source]).distinct().where(
+                        (table.c.rel == rel) & table.c.target.in_(batch))
+                    related.update(str(row[0]) for row in connection.execute(query))
+        return related
+
+    def clear(self):
+        with self.engine.begin() as connection:
+            connection.execute(self.table.delete())
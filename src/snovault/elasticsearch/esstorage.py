@@ -55,26 +55,75 @@ class CachedModel(object):
         request = get_root_request()
         if request is None:
             return False
-        edits = dict.get(request.session, 'edits', None)
+        edits = session_edits(request)
         if edits is None:
             return False
-        version = self.hit['_version']
+        relevant = edits.since(self.hit['_version'])
+        if relevant is None:
+            return False
+        updated, renamed = relevant
         source = self.source
-        linked_uuids = set(source['linked_uuids'])
-        embedded_uuids = set(source['embedded_uuids'])
-        for xid, updated, linked in edits:
-            if xid < version:
-                continue
-            if not embedded_uuids.isdisjoint(updated):
-                return True
-            if not linked_uuids.isdisjoint(linked):
-                return True
+        if not updated.isdisjoint(source['embedded_uuids']):
+            return True
+        if not renamed.isdisjoint(source['linked_uuids']):
+            return True
         return False
 
     def used_for(self, item):
         alsoProvides(item, ICachedItem)
 
 
+def session_edits(request):
+    """ Returns the SessionEdits for the session's recent edits, if any.
+
+    It is kept on the request until the edits change.
+    """
+    edits = dict.get(request.session, 'edits', None)
+    if not edits:
+        return None
+    xids = tuple(edit[0] for edit in edits)
+    cached = getattr(request, '_session_edits', None)
+    if cached is None or cached.xids != xids:
+        cached = request._session_edits = SessionEdits(edits)
+    return cached
+
+
+class SessionEdits(object):
+    """ Uuids updated and renamed by a session's recent edits.
+    """
+    def __init__(self, edits):
+        self.xids = tuple(edit[0] for edit in edits)
+        self.edits = [
+            (xid, frozenset(updated), frozenset(renamed))
+            for xid, updated, renamed in edits
+        ]
+        self.min_xid = min(self.xids)
+        self.max_xid = max(self.xids)
+        self.all = self.union(self.edits)
+        self.by_version = {}
+
+    @staticmethod
+    def union(edits):
+        updated = frozenset().union(*(edit[1] for edit in edits))
+        renamed = frozenset().union(*(edit[2] for edit in edits))
+        return updated, renamed
+
+    def since(self, version):
+        """ Returns (updated, renamed) for edits from version on, or None.
+        """
+        if version > self.max_xid:
+            return None
+        if version <= self.min_xid:
+            return self.all
+        try:
+            return self.by_version[version]
+        except KeyError:
+            pass
+        relevant = [edit for edit in self.edits if edit[0] >= version]
+        result = self.by_version[version] = self.union(relevant)
+        return result
+
+
 class PickStorage(object):
     def __init__(self, read, write):
         self.read = read
@@ -86,9 +135,9 @@ class PickStorage(object):
             return self.read
         return self.write
 
-    def get_by_uuid(self, uuid):
+    def get_by_uuid(self, uuid, item_type=None):
         storage = self.storage()
-        model = storage.get_by_uuid(uuid)
+        model = storage.get_by_uuid(uuid, item_type=item_type)
         if storage is self.read:
             if model is None or model.invalidated():
                 force_database_for_request()
@@ -104,6 +153,34 @@ class PickStorage(object):
                 return self.write.get_by_unique_key(unique_key, name)
         return model
 
+    def get_by_uuids(self, uuids):
+        uuids = list(uuids)
+        storage = self.storage()
+        models = storage.get_by_uuids(uuids)
+        if storage is self.read:
+            models = [model for model in models if not model.invalidated()]
+            found = {str(model.uuid) for model in models}
+            missing = [uuid for uuid in uuids if str(uuid) not in found]
+            if missing:
+                force_database_for_request()
+                models.extend(self.write.get_by_uuids(missing))
+        return models
+
+    def get_by_unique_keys(self, pairs):
+        pairs = list(pairs)
+        storage = self.storage()
+        found = storage.get_by_unique_keys(pairs)
+        if storage is self.read:
+            found = {
+                pair: model for pair, model in found.items()
+                if not model.invalidated()
+            }
+            missing = [pair for pair in pairs if pair not in found]
+            if missing:
+                force_database_for_request()
+                found.update(self.write.get_by_unique_keys(missing))
+        return found
+
     def get_rev_links(self, model, rel, *item_types):
         return self.storage().get_rev_links(model, rel, *item_types)
 
@@ -119,9 +196,13 @@ class PickStorage(object):
     def update(self, model, properties=None, sheets=None, unique_keys=None, links=None):
         return self.write.update(model, properties, sheets, unique_keys, links)
 
+    def create_many(self, records):
+        return self.write.create_many(records)
+
 
 class ElasticSearchStorage(object):
     writeable = False
+    batchsize = 1000
 
     def __init__(self, es, index):
         self.es = es
@@ -135,11 +216,19 @@ class ElasticSearchStorage(object):
         model = CachedModel(hits[0])
         return model
 
-    def get_by_uuid(self, uuid):
+    def get_by_uuid(self, uuid, item_type=None):
+        """ The document _id is the uuid, so it is fetched directly from the
+        item_type index when that is known and otherwise found by an ids query.
+        """
+        if item_type is not None:
+            hit = self.es.get(index=item_type, doc_type=item_type, id=str(uuid), ignore=404)
+            if hit.get('found'):
+                return CachedModel(hit)
+            # Collections may contain items of other types
         query = {
             'query': {
-                'term': {
-                    'uuid': str(uuid)
+                'ids': {
+                    'values': [str(uuid)]
                 }
             },
             'version': True
@@ -160,6 +249,54 @@ class ElasticSearchStorage(object):
         }
         return self._one(query)
 
+    def get_by_uuids(self, uuids):
+        uuids = sorted({str(uuid) for uuid in uuids})
+        models = []
+        for start in range(0, len(uuids), self.batchsize):
+            batch = uuids[start:start + self.batchsize]
+            query = {
+                'query': {
+                    'ids': {'values': batch},
+                },
+                'version': True,
+            }
+            result = self.es.search(index=self.index, body=query, _source=True, size=len(batch))
+            models.extend(CachedModel(hit) for hit in result['hits']['hits'])
+        return models
+
+    def get_by_unique_keys(self, pairs):
+        names_by_key = {}
+        for unique_key, name in pairs:
+            names_by_key.setdefault(unique_key, set()).add(name)
+        found = {}
+        ambiguous = set()
+        for unique_key, names in names_by_key.items():
+            names = sorted(names)
+            term = 'unique_keys.' + unique_key
+            for start in range(0, len(names), self.batchsize):
+                batch = names[start:start + self.batchsize]
+                query = {
+                    'query': {
+                        'terms': {term: batch}
+                    },
+                    'version': True,
+                }
+                result = self.es.search(index=self.index, body=query, size=2 * len(batch))
+                batch = set(batch)
+                for hit in result['hits']['hits']:
+                    model = CachedModel(hit)
+                    for name in model.source.get('unique_keys', {}).get(unique_key, []):
+                        if name not in batch:
+                            continue
+                        pair = (unique_key, name)
+                        # Like get_by_unique_key, a key must match one document
+                        if pair in found:
+                            ambiguous.add(pair)
+                        found[pair] = model
+        for pair in ambiguous:
+            del found[pair]
+        return found
+
     def get_rev_links(self, model, rel, *item_types):
         filter_ = {'term': {'links.' + rel: str(model.uuid)}}
         if item_types:
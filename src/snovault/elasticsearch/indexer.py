@@ -1,13 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
 from elasticsearch.exceptions import (
     ConflictError,
     ConnectionError,
     NotFoundError,
     TransportError,
 )
+from elasticsearch.helpers import (
+    scan,
+    streaming_bulk,
+)
+from pyramid.settings import asbool
 from pyramid.view import view_config
+from sqlalchemy import (
+    func,
+    text,
+)
 from sqlalchemy.exc import StatementError
 from snovault import (
     COLLECTIONS,
+    CONNECTION,
     DBSESSION,
     STORAGE
 )
@@ -15,6 +26,7 @@ from snovault.storage import (
     TransactionRecord,
 )
 from urllib3.exceptions import ReadTimeoutError
+from .dependency_graph import DependencyGraph
 from .interfaces import (
     ELASTIC_SEARCH,
     INDEXER
@@ -25,9 +37,12 @@ from .indexer_state import (
     all_types,
     SEARCH_MAX
 )
+from .state_storage import state_backend
 import datetime
+import hashlib
 import logging
 import pytz
+import resource
 import time
 import copy
 import json
@@ -37,6 +52,9 @@ es_logger = logging.getLogger("elasticsearch")
 es_logger.setLevel(logging.ERROR)
 log = logging.getLogger(__name__)
 MAX_CLAUSES_FOR_ES = 8192
+RETRY_BACKOFFS = [0, 10, 20, 40, 80]
+# Bulk item statuses worth retrying; 'N/A' is reported for connection failures.
+RETRYABLE_STATUSES = {429, 502, 503, 504, 'N/A'}
 
 def includeme(config):
     config.add_route('index', '/index')
@@ -44,72 +62,55 @@ def includeme(config):
     registry = config.registry
     registry[INDEXER] = Indexer(registry)
 
-def get_related_uuids(request, es, updated, renamed):
-    '''Returns (set of uuids, True if all_uuids)'''
+def get_related_uuids(request, es, updated, renamed, graph=None):
+    '''Returns the set of uuids that embed or link to updated or renamed uuids.
+
+    A complete dependency graph is consulted when given, otherwise
+    elasticsearch is searched.
+    '''
 
     updated_count = len(updated)
     renamed_count = len(renamed)
-    if (updated_count + renamed_count) > MAX_CLAUSES_FOR_ES:
-        return (all_uuids(request.registry), True)
-    elif (updated_count + renamed_count) == 0:
-        return (set(), False)
+    if (updated_count + renamed_count) == 0:
+        return set()
+    elif graph is not None:
+        return graph.dependents(updated, renamed)
 
     es.indices.refresh('_all')
 
-    # TODO: batching may allow us to drive a partial reindexing much greater than 99999
-    #BATCH_COUNT = 100  # NOTE: 100 random uuids returned > 99999 results!
-    #beg = 0
-    #end = BATCH_COUNT
-    #related_set = set()
-    #updated_list = list(updated)  # Must be lists
-    #renamed_list = list(renamed)
-    #while updated_count > beg or renamed_count > beg:
-    #    if updated_count > end or beg > 0:
-    #        log.error('Indexer looking for related uuids by BATCH[%d,%d]' % (beg, end))
-    #
-    #    updated = []
-    #    if updated_count > beg:
-    #        updated = updated_list[beg:end]
-    #    renamed = []
-    #    if renamed_count > beg:
-    #        renamed = renamed_list[beg:end]
-    #
-    #     search ...
-    #     accumulate...
-    #
-    #    beg += BATCH_COUNT
-    #    end += BATCH_COUNT
-
-
-    res = es.search(index='_all', size=SEARCH_MAX, request_timeout=60, body={
+    # Terms are searched in slices, each scrolled through so there is no
+    # limit on hits, with a bounded number of requests in flight.
+    settings = request.registry.settings
+    slice_size = min(int(settings.get('indexer.related_slice_size', 1024)), MAX_CLAUSES_FOR_ES)
+    concurrency = int(settings.get('indexer.related_concurrency', 4))
+    slices = [
+        (field, values[start:start + slice_size])
+        for field, values in (('embedded_uuids', list(updated)), ('linked_uuids', list(renamed)))
+        for start in range(0, len(values), slice_size)
+    ]
+    if len(slices) > 2:
+        log.info('Indexer looking for related uuids in %d slices', len(slices))
+
+    related_set = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for uuids in executor.map(lambda args: scan_related_uuids(es, *args), slices):
+            related_set.update(uuids)
+
+    return related_set
+
+
+def scan_related_uuids(es, field, values):
+    '''Returns the ids of all documents with any of values in field.'''
+    hits = scan(es, index='_all', size=1000, request_timeout=60, query={
         'query': {
-            'bool': {
-                'should': [
-                    {
-                        'terms': {
-                            'embedded_uuids': updated,
-                            '_cache': False,
-                        },
-                    },
-                    {
-                        'terms': {
-                            'linked_uuids': renamed,
-                            '_cache': False,
-                        },
-                    },
-                ],
+            'terms': {
+                field: values,
+                '_cache': False,
             },
         },
         '_source': False,
     })
-
-    if res['hits']['total'] > SEARCH_MAX:
-        return (all_uuids(request.registry), True)
-
-    related_set = {hit['_id'] for hit in res['hits']['hits']}
-
-    return (related_set, False)
-
+    return [hit['_id'] for hit in hits]
 
 
 @view_config(route_name='index', request_method='POST', permission="index")
@@ -129,21 +130,30 @@ def index(request):
     restart=False
     invalidated = []
     xmin = -1
+    # Dependency graph is only consulted once a full reindex has populated it.
+    graph = indexer.dependency_graph
+    graph_complete = False
+    all_indexed = False
+    if graph is not None:
+        status = es.get(index=INDEX, doc_type='meta', id='indexing', ignore=[400, 404])
+        graph_complete = status.get('found', False) and \
+            status['_source'].get('dependency_graph', False)
 
     # Currently 2 possible followup indexers (base.ini [set stage_for_followup = vis_indexer, region_indexer])
     stage_for_followup = list(request.registry.settings.get("stage_for_followup", '').replace(' ','').split(','))
 
     # May have undone uuids from prior cycle
-    state = IndexerState(es, INDEX, followups=stage_for_followup)
+    state = IndexerState(es, INDEX, followups=stage_for_followup,
+                         backend=state_backend(request.registry))
 
     (xmin, invalidated, restart) = state.priority_cycle(request)
-    # OPTIONAL: restart support
-    if restart:  # Currently not bothering with restart!!!
-        xmin = -1
-        invalidated = []
-    # OPTIONAL: restart support
-
-    result = state.get_initial_state()  # get after checking priority!
+    if restart:
+        # Resume the interrupted cycle at its xmin, skipping checkpointed uuids.
+        # Its snapshot is gone, so remaining uuids are indexed as of now; any
+        # later changes are picked up by the next cycle from the same last_xmin.
+        result = state.get()
+    else:
+        result = state.get_initial_state()  # get after checking priority!
 
     if xmin == -1 or len(invalidated) == 0:
         xmin = get_current_xmin(request)
@@ -166,7 +176,7 @@ def index(request):
             last_xmin=last_xmin,
         )
 
-    if len(invalidated) > SEARCH_MAX:  # Priority cycle already set up
+    if restart or len(invalidated) > SEARCH_MAX:  # Priority cycle already set up
         flush = True
     else:
 
@@ -175,25 +185,10 @@ def index(request):
             result['types'] = types = request.json.get('types', None)
             invalidated = list(all_uuids(request.registry, types))
             flush = True
+            all_indexed = types is None
         else:
-            txns = session.query(TransactionRecord).filter(
-                TransactionRecord.xid >= last_xmin,
-            )
-
             invalidated = set(invalidated)  # not empty if API index request occurred
-            updated = set()
-            renamed = set()
-            max_xid = 0
-            txn_count = 0
-            for txn in txns.all():
-                txn_count += 1
-                max_xid = max(max_xid, txn.xid)
-                if first_txn is None:
-                    first_txn = txn.timestamp
-                else:
-                    first_txn = min(first_txn, txn.timestamp)
-                renamed.update(txn.data.get('renamed', ()))
-                updated.update(txn.data.get('updated', ()))
+            (updated, renamed, txn_count, max_xid, first_txn) = scan_transactions(session, last_xmin)
 
             if invalidated:        # reindex requested, treat like updated
                 updated |= invalidated
@@ -203,22 +198,19 @@ def index(request):
                 state.send_notices()
                 return result
 
-            (related_set, full_reindex) = get_related_uuids(request, es, updated, renamed)
-            if full_reindex:
-                invalidated = related_set
-                flush = True
-            else:
-                invalidated = related_set | updated
-                result.update(
-                    max_xid=max_xid,
-                    renamed=renamed,
-                    updated=updated,
-                    referencing=len(related_set),
-                    invalidated=len(invalidated),
-                    txn_count=txn_count
-                )
-                if first_txn is not None:
-                    result['first_txn_timestamp'] = first_txn.isoformat()
+            related_set = get_related_uuids(
+                request, es, updated, renamed, graph if graph_complete else None)
+            invalidated = related_set | updated
+            result.update(
+                max_xid=max_xid,
+                renamed=renamed,
+                updated=updated,
+                referencing=len(related_set),
+                invalidated=len(invalidated),
+                txn_count=txn_count
+            )
+            if first_txn is not None:
+                result['first_txn_timestamp'] = first_txn.isoformat()
 
             if invalidated and not dry_run:
                 # Exporting a snapshot mints a new xid, so only do so when required.
@@ -228,17 +220,31 @@ def index(request):
                     snapshot_id = connection.execute('SELECT pg_export_snapshot();').scalar()
 
     if invalidated and not dry_run:
-        if len(stage_for_followup) > 0:
-            # Note: undones should be added before, because those uuids will (hopefully) be indexed in this cycle
-            state.prep_for_followup(xmin, invalidated)
+        if restart:
+            # Followup uuids were already prepared by the interrupted cycle.
+            result = state.resume_cycle(result)
+        else:
+            if len(stage_for_followup) > 0:
+                # Note: undones should be added before, because those uuids will (hopefully) be indexed in this cycle
+                state.prep_for_followup(xmin, invalidated)
 
-        result = state.start_cycle(invalidated, result)
+            result = state.start_cycle(invalidated, result)
+            invalidated = state.todo_uuids
 
         # Do the work...
 
-        errors = indexer.update_objects(request, invalidated, xmin, snapshot_id, restart)
+        stats = {}
+        errors = indexer.update_objects(
+            request, invalidated, xmin, snapshot_id, restart, stats, state.checkpoint)
+        if stats:
+            result['indexing_stats'] = stats
 
         result = state.finish_cycle(result,errors)
+        result['peak_rss'] = get_peak_rss()
+
+        if graph is not None:
+            # A failed render leaves its document's dependencies unrecorded.
+            result['dependency_graph'] = bool(graph_complete or (all_indexed and not errors))
 
         if errors:
             result['errors'] = errors
@@ -271,6 +277,58 @@ def index(request):
     return result
 
 
+def scan_transactions(session, last_xmin, yield_per=1000):
+    '''Returns (updated, renamed, txn_count, max_xid, first_txn) since last_xmin
+
+    With jsonb (Postgres 9.4+) the updated / renamed sets are built in SQL,
+    otherwise transaction records are streamed rather than loaded at once.
+    '''
+    updated = set()
+    renamed = set()
+    dialect = session.connection().dialect
+    if dialect.name == 'postgresql' and dialect.server_version_info >= (9, 4):
+        txn_count, max_xid, first_txn = session.query(
+            func.count(TransactionRecord.order),
+            func.max(TransactionRecord.xid),
+            func.min(TransactionRecord.timestamp),
+        ).filter(
+            TransactionRecord.xid >= last_xmin,
+        ).one()
+        for key, uuids in (('updated', updated), ('renamed', renamed)):
+            rows = session.execute(text(
+                "SELECT DISTINCT jsonb_array_elements_text((data::jsonb)->:key) FROM transactions "
+                "WHERE xid >= :xmin"
+            ), {'key': key, 'xmin': last_xmin})
+            uuids.update(row[0] for row in rows)
+        return (updated, renamed, txn_count, max_xid or 0, first_txn)
+
+    txns = session.query(TransactionRecord).filter(
+        TransactionRecord.xid >= last_xmin,
+    )
+    max_xid = 0
+    txn_count = 0
+    first_txn = None
+    for txn in txns.yield_per(yield_per):
+        txn_count += 1
+        max_xid = max(max_xid, txn.xid)
+        if first_txn is None:
+            first_txn = txn.timestamp
+        else:
+            first_txn = min(first_txn, txn.timestamp)
+        renamed.update(txn.data.get('renamed', ()))
+        updated.update(txn.data.get('updated', ()))
+    return (updated, renamed, txn_count, max_xid, first_txn)
+
+
+def get_peak_rss():
+    '''Peak resident memory in bytes of this process and of its largest finished child.'''
+    # ru_maxrss is in kilobytes on linux
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) * 1024
+
+
 def get_current_xmin(request):
     session = request.registry[DBSESSION]()
     connection = session.connection()
@@ -297,21 +355,192 @@ class Indexer(object):
         self.es = registry[ELASTIC_SEARCH]
         self.esstorage = registry[STORAGE]
         self.index = registry.settings['snovault.elasticsearch.index']
+        self.chunk_size = int(registry.settings.get('indexer.chunk_size', 1024))
+        # Bulk mode buffers rendered documents and writes them through _bulk.
+        self.bulk_size = int(registry.settings.get('indexer.bulk_size', 0))
+        self.bulk_interval = float(registry.settings.get('indexer.bulk_interval', 10))
+        # Database rows for this many uuids are loaded together before rendering.
+        self.prefetch_size = int(registry.settings.get('indexer.prefetch_size', 100))
+        # Documents whose hash matches the one already in elasticsearch are not rewritten.
+        self.skip_unchanged = asbool(registry.settings.get('indexer.skip_unchanged', False))
+        self.dependency_graph = None
+        if asbool(registry.settings.get('indexer.dependency_graph', False)):
+            self.dependency_graph = DependencyGraph(registry)
+
+    def update_objects(self, request, uuids, xmin, snapshot_id=None, restart=False, stats=None,
+                       checkpoint=None):
+        '''Indexes uuids, returning a list of errors.
+
+        stats, if given, is a dict that indexers may add timings to.
+        checkpoint, if given, is called with each chunk of uuids once indexed.
+        '''
+        uuids = list(uuids)
+        # Once for the whole cycle, so no chunk embeds a stale result for a
+        # uuid that is only reindexed in a later chunk.
+        self.invalidate_embeds(request, uuids)
+        if checkpoint is None:
+            return self.update_chunk(request, uuids, xmin, stats)
+        errors = []
+        for start in range(0, len(uuids), self.chunk_size):
+            chunk = uuids[start:start + self.chunk_size]
+            errors.extend(self.update_chunk(request, chunk, xmin, stats))
+            checkpoint(chunk)
+        return errors
 
-    def update_objects(self, request, uuids, xmin, snapshot_id=None, restart=False):
+    def update_chunk(self, request, uuids, xmin, stats=None):
+        '''Indexes a chunk of a cycle whose embeds have been invalidated.'''
+        dependencies = [] if self.dependency_graph is not None else None
+        if self.bulk_size > 0:
+            errors = self.update_objects_bulk(request, uuids, xmin, dependencies, stats)
+        else:
+            errors = []
+            for i, uuid in enumerate(self.iter_prefetched(request, uuids)):
+                error = self.update_object(
+                    request, uuid, xmin, dependencies=dependencies, stats=stats)
+                if error is not None:
+                    errors.append(error)
+                self.update_dependencies(dependencies)
+                if (i + 1) % 50 == 0:
+                    log.info('Indexing %d', i + 1)
+
+        self.update_dependencies(dependencies, force=True)
+        return errors
+
+    def render_objects(self, request, uuids):
+        '''Renders uuids without writing them, returning (docs, errors, seconds).
+
+        Embeds must already have been invalidated for the whole cycle.
+        '''
+        start = time.time()
+        dependencies = [] if self.dependency_graph is not None else None
+        docs = []
+        errors = []
+        for uuid in self.iter_prefetched(request, uuids):
+            doc, error = self.render_object(request, uuid, dependencies)
+            if error is not None:
+                errors.append(error)
+            else:
+                docs.append(doc)
+            self.update_dependencies(dependencies)
+        self.update_dependencies(dependencies, force=True)
+        return docs, errors, time.time() - start
+
+    def invalidate_embeds(self, request, uuids):
+        embed_cache = request.registry[CONNECTION].persistent_embed_cache
+        if embed_cache is not None:
+            # Catches changes which do not show up as a new tid, e.g. reverse links.
+            embed_cache.invalidate(uuids)
+
+    def update_objects_bulk(self, request, uuids, xmin, dependencies=None, stats=None):
         errors = []
-        for i, uuid in enumerate(uuids):
-            error = self.update_object(request, uuid, xmin)
+        buffer = []
+        last_flush = time.time()
+        for i, uuid in enumerate(self.iter_prefetched(request, uuids)):
+            doc, error = self.render_object(request, uuid, dependencies)
             if error is not None:
                 errors.append(error)
+            else:
+                buffer.append(doc)
+            if len(buffer) >= self.bulk_size or \
+                    (buffer and time.time() - last_flush >= self.bulk_interval):
+                errors.extend(self.flush_bulk(buffer, xmin, stats))
+                buffer = []
+                last_flush = time.time()
+                self.update_dependencies(dependencies)
             if (i + 1) % 50 == 0:
                 log.info('Indexing %d', i + 1)
 
+        if buffer:
+            errors.extend(self.flush_bulk(buffer, xmin, stats))
         return errors
 
-    def update_object(self, request, uuid, xmin, restart=False):
+    def update_dependencies(self, dependencies, force=False):
+        '''Writes collected dependency records to the graph once there are enough.'''
+        if not dependencies:
+            return
+        if force or len(dependencies) >= self.dependency_graph.batchsize:
+            self.dependency_graph.update(dependencies)
+            del dependencies[:]
+
+    def iter_prefetched(self, request, uuids):
+        '''Yields uuids, seeding the item cache for each batch before it is rendered.'''
+        if self.prefetch_size <= 0:
+            for uuid in uuids:
+                yield uuid
+            return
+        connection = request.registry[CONNECTION]
+        batch = []
+        for uuid in uuids:
+            batch.append(uuid)
+            if len(batch) < self.prefetch_size:
+                continue
+            connection.prefetch(batch)
+            for uuid in batch:
+                yield uuid
+            batch = []
+        if batch:
+            connection.prefetch(batch)
+            for uuid in batch:
+                yield uuid
+
+    def render_object(self, request, uuid, dependencies=None):
+        '''Returns (document, error) for the @@index-data of uuid.
+
+        When dependencies is a list, (uuid, embedded_uuids, linked_uuids) of
+        the rendered document is appended to it.
+        '''
         request.datastore = 'database'  # required by 2-step indexer
-
+        try:
+            doc = request.embed('/%s/@@index-data/' % uuid, as_user='INDEXER')
+        except StatementError:
+            # Can't reconnect until invalid transaction is rolled back
+            raise
+        except Exception as e:
+            log.error('Error rendering /%s/@@index-data', uuid, exc_info=True)
+            return None, self.error_record(uuid, repr(e))
+        if self.skip_unchanged:
+            doc['index_hash'] = self.index_hash(doc)
+        if dependencies is not None:
+            dependencies.append((uuid, doc['embedded_uuids'], doc['linked_uuids']))
+        return doc, None
+
+    def error_record(self, uuid, error_message):
+        timestamp = datetime.datetime.now().isoformat()
+        return {'error_message': error_message, 'timestamp': timestamp, 'uuid': str(uuid)}
+
+    def index_hash(self, doc):
+        '''Stable hash of a rendered document, excluding any index_hash.'''
+        doc = {k: v for k, v in doc.items() if k != 'index_hash'}
+        data = json.dumps(doc, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def skip_unchanged_docs(self, docs, stats=None):
+        '''Returns the docs whose index_hash differs from the stored document.'''
+        if not self.skip_unchanged or not docs:
+            return docs
+        try:
+            res = self.es.mget(body={'docs': [
+                {
+                    '_index': doc['item_type'],
+                    '_type': doc['item_type'],
+                    '_id': str(doc['uuid']),
+                    '_source': ['index_hash'],
+                }
+                for doc in docs
+            ]}, request_timeout=30)
+        except (ConnectionError, ReadTimeoutError, TransportError) as e:
+            log.warning('Could not fetch index hashes: %r', e)
+            return docs
+        stored = {
+            hit['_id']: hit['_source'].get('index_hash')
+            for hit in res['docs'] if hit.get('found')
+        }
+        changed = [doc for doc in docs if stored.get(str(doc['uuid'])) != doc['index_hash']]
+        if stats is not None:
+            stats['skipped'] = stats.get('skipped', 0) + len(docs) - len(changed)
+        return changed
+
+    def update_object(self, request, uuid, xmin, restart=False, dependencies=None, stats=None):
         # OPTIONAL: restart support
         # If a restart occurred in the middle of indexing, this uuid might have already been indexd, so skip redoing it.
         # if restart:
@@ -324,44 +553,93 @@ class Indexer(object):
         #         pass
         # OPTIONAL: restart support
 
+        doc, error = self.render_object(request, uuid, dependencies)
+        if error is not None:
+            return error
+        if not self.skip_unchanged_docs([doc], stats):
+            return
+
         last_exc = None
-        try:
-            doc = request.embed('/%s/@@index-data/' % uuid, as_user='INDEXER')
-        except StatementError:
-            # Can't reconnect until invalid transaction is rolled back
-            raise
-        except Exception as e:
-            log.error('Error rendering /%s/@@index-data', uuid, exc_info=True)
-            last_exc = repr(e)
-
-        if last_exc is None:
-            for backoff in [0, 10, 20, 40, 80]:
-                time.sleep(backoff)
-                try:
-                    self.es.index(
-                        index=doc['item_type'], doc_type=doc['item_type'], body=doc,
-                        id=str(uuid), version=xmin, version_type='external_gte',
-                        request_timeout=30,
-                    )
-                except StatementError:
-                    # Can't reconnect until invalid transaction is rolled back
-                    raise
-                except ConflictError:
+        for backoff in RETRY_BACKOFFS:
+            time.sleep(backoff)
+            try:
+                self.es.index(
+                    index=doc['item_type'], doc_type=doc['item_type'], body=doc,
+                    id=str(uuid), version=xmin, version_type='external_gte',
+                    request_timeout=30,
+                )
+            except StatementError:
+                # Can't reconnect until invalid transaction is rolled back
+                raise
+            except ConflictError:
+                log.warning('Conflict indexing %s at version %d', uuid, xmin)
+                return
+            except (ConnectionError, ReadTimeoutError, TransportError) as e:
+                log.warning('Retryable error indexing %s: %r', uuid, e)
+                last_exc = repr(e)
+            except Exception as e:
+                log.error('Error indexing %s', uuid, exc_info=True)
+                last_exc = repr(e)
+                break
+            else:
+                # Get here on success and outside of try
+                return
+
+        return self.error_record(uuid, last_exc)
+
+    def bulk_action(self, doc, xmin):
+        return {
+            '_op_type': 'index',
+            '_index': doc['item_type'],
+            '_type': doc['item_type'],
+            '_id': str(doc['uuid']),
+            '_version': xmin,
+            '_version_type': 'external_gte',
+            '_source': doc,
+        }
+
+    def flush_bulk(self, docs, xmin, stats=None):
+        '''Writes docs through the _bulk endpoint, returning a list of errors.
+
+        Each bulk response item is treated like the result of a single
+        es.index() call: version conflicts are logged and dropped, retryable
+        failures are resent after a backoff and anything else is an error.
+        Unchanged documents are skipped (see skip_unchanged_docs).
+        '''
+        docs = self.skip_unchanged_docs(docs, stats)
+        pending = {str(doc['uuid']): doc for doc in docs}
+        errors = []
+        last_exc = {}
+        for backoff in RETRY_BACKOFFS:
+            if not pending:
+                break
+            time.sleep(backoff)
+            actions = [self.bulk_action(doc, xmin) for doc in pending.values()]
+            results = streaming_bulk(
+                self.es, actions, chunk_size=len(actions),
+                raise_on_error=False, raise_on_exception=False,
+                request_timeout=30,
+            )
+            for ok, item in results:
+                op_type, info = item.popitem()
+                uuid = info['_id']
+                if ok:
+                    del pending[uuid]
+                    continue
+                status = info.get('status')
+                if status == 409:
                     log.warning('Conflict indexing %s at version %d', uuid, xmin)
-                    return
-                except (ConnectionError, ReadTimeoutError, TransportError) as e:
-                    log.warning('Retryable error indexing %s: %r', uuid, e)
-                    last_exc = repr(e)
-                except Exception as e:
-                    log.error('Error indexing %s', uuid, exc_info=True)
-                    last_exc = repr(e)
-                    break
+                    del pending[uuid]
+                elif status in RETRYABLE_STATUSES:
+                    log.warning('Retryable error indexing %s: %r', uuid, info.get('error'))
+                    last_exc[uuid] = repr(info.get('exception', info.get('error')))
                 else:
-                    # Get here on success and outside of try
-                    return
+                    log.error('Error indexing %s: %r', uuid, info.get('error'))
+                    errors.append(self.error_record(uuid, repr(info.get('error'))))
+                    del pending[uuid]
 
-        timestamp = datetime.datetime.now().isoformat()
-        return {'error_message': last_exc, 'timestamp': timestamp, 'uuid': str(uuid)}
+        errors.extend(self.error_record(uuid, last_exc.get(uuid)) for uuid in pending)
+        return errors
 
     def shutdown(self):
         pass
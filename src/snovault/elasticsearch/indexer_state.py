@@ -15,10 +15,19 @@ from snovault.storage import (
     TransactionRecord,
 )
 from urllib3.exceptions import ReadTimeoutError
+from .state_storage import (
+    ESStateBackend,
+    decode_chunk,
+    encode_chunks,
+    pack_bytes,
+    state_backend,
+    unpack_bytes,
+)
 from .interfaces import (
     ELASTIC_SEARCH,
     INDEXER
 )
+import bisect
 import datetime
 import logging
 import pytz
@@ -38,21 +47,26 @@ def includeme(config):
     config.add_route('_indexer_state', '/_indexer_state')
     config.scan(__name__)
 
+
 class IndexerState(object):
     # Keeps track of uuids and indexer state by cycle.  Also handles handoff of uuids to followup indexer
-    def __init__(self, es, index, title='primary', followups=[]):
+    def __init__(self, es, index, title='primary', followups=[], backend=None):
         self.es = es
         self.index = index  # "index where indexerstate is stored"
+        if backend is None:
+            backend = ESStateBackend(es, index)
+        self.backend = backend  # where state documents are kept, see state_storage
 
         self.title           = title
         self.state_id        = self.title + '_indexer'       # State of the current or last cycle
         self.todo_set        = self.title + '_in_progress'   # one cycle of uuids, sent to the Secondary Indexer
         #self.failed_set      = self.title + '_failed'
         #self.done_set        = self.title + '_done'          # Trying to get all uuids from 'todo' to this set
+        self.checkpoint_id   = self.title + '_checkpoint'    # bitmap of todo_set uuids already indexed
         self.troubled_set    = self.title + '_troubled'      # uuids that failed to index in any cycle
         self.last_set        = self.title + '_last_cycle'    # uuids in the most recent finished cycle
         self.success_set     = None                          # None is the same as self.done_set
-        self.cleanup_this_cycle = [self.todo_set]  # ,self.failed_set,self.done_set]  # Clean up at end of current cycle
+        self.cleanup_this_cycle = [self.todo_set, self.checkpoint_id]  # ,self.failed_set,self.done_set]  # Clean up at end of current cycle
         self.cleanup_last_cycle = [self.last_set,self.troubled_set]              # Clean up at beginning of next cycle
         self.override           = 'reindex_' + self.title      # If exists then reindex all
         # DO NOT INHERIT! These keys are for passing on to other indexers
@@ -66,6 +80,9 @@ class IndexerState(object):
                 assert list_id == self.staged_for_vis_list or list_id == self.staged_for_regions_list
                 self.followup_lists.append(list_id)
         self.clock = {}
+        self.todo_uuids = None  # sorted uuids of the current cycle, for checkpoints
+        self.done_bits = None
+        self.done_count = 0
         # some goals:
         # 1) Detect and recover from interrupted cycle - working but ignored for now
         # 2) Record (double?) failures and consider blacklisting them - not tried, could do.
@@ -73,31 +90,64 @@ class IndexerState(object):
     # Private-ish primitives...
     def get_obj(self, id, doc_type='meta'):
         try:
-            return self.es.get(index=self.index, doc_type=doc_type, id=id).get('_source',{})  # TODO: snovault/meta
+            return self.backend.get(id, doc_type)  # TODO: snovault/meta
         except:
             return {}
 
     def put_obj(self, id, obj, doc_type='meta'):
         try:
-            self.es.index(index=self.index, doc_type=doc_type, id=id, body=obj)
+            self.backend.put(id, obj, doc_type)
         except:
             log.warn("Failed to save to es: " + id, exc_info=True)
 
     def delete_objs(self, ids, doc_type='meta'):
         for id in ids:
-            try:
-                self.es.delete(index=self.index, doc_type=doc_type, id=id)
-            except:
-                pass
+            doc_ids = [id]
+            if doc_type == 'meta':
+                # Lists are chunked across documents
+                doc_ids = self.chunk_ids(id, self.get_obj(id))
+            for doc_id in doc_ids:
+                try:
+                    self.backend.delete(doc_id, doc_type)
+                except:
+                    pass
+
+    # Lists are stored as a head document {'chunks': n, 'count': c} and n chunk
+    # documents '<id>.<i>' (see state_storage.encode_chunks), so appending
+    # writes only new chunks and the count is known without decoding.
+    # Lists in the older {'list': [...], 'count': c} form are still read.
+
+    def chunk_ids(self, id, head):
+        return [id] + ['%s.%d' % (id, i) for i in range(head.get('chunks', 0))]
 
     def get_list(self, id):
-        return self.get_obj(id).get('list',[])
+        head = self.get_obj(id)
+        if 'chunks' not in head:
+            return head.get('list',[])
+        values = []
+        for chunk in self.backend.mget(self.chunk_ids(id, head)[1:]):
+            values.extend(decode_chunk(chunk))
+        return values
 
     def get_count(self, id):
         return self.get_obj(id).get('count',0)
 
     def put_list(self, id, a_list):
-        return self.put_obj(id, { 'list': a_list, 'count': len(a_list) })
+        self.delete_objs([id])
+        return self.write_chunks(id, {'chunks': 0, 'count': 0}, a_list)
+
+    def write_chunks(self, id, head, a_list):
+        for chunk in encode_chunks(a_list):
+            self.put_obj('%s.%d' % (id, head['chunks']), chunk)
+            head['chunks'] += 1
+            head['count'] += chunk['count']
+        self.put_obj(id, head)
+
+    def put_uuids(self, id, uuids):
+        '''Stores uuids and returns them as a sorted list.'''
+        uuids = sorted({str(uuid) for uuid in uuids})
+        self.put_list(id, uuids)
+        return uuids
 
     #def get_diff(self,orig_id, subtract_ids):
     #    result_set = set(self.get_list(orig_id))
@@ -118,7 +168,12 @@ class IndexerState(object):
         self.put_list(id, set_to_update)
 
     def list_extend(self, id, vals):
-        list_to_extend = self.get_list(id)
+        head = self.get_obj(id)
+        if 'chunks' in head:
+            # Append without reading existing chunks
+            self.write_chunks(id, head, vals)
+            return
+        list_to_extend = head.get('list', [])
         if len(list_to_extend) > 0:
             list_to_extend.extend(vals)  # TODO: consider capping at SEARCH_MAX (keeping count but not uuids).  Requires followup handoff work.
         else:
@@ -126,10 +181,27 @@ class IndexerState(object):
 
         self.put_list(id, list_to_extend)
 
+    def list_extend_from(self, id, from_id):
+        '''Appends list from_id to list id, copying chunks without decoding them.'''
+        from_head = self.get_obj(from_id)
+        head = self.get_obj(id)
+        if 'chunks' not in from_head or ('chunks' not in head and head):
+            self.list_extend(id, self.get_list(from_id))
+            return
+        if 'chunks' not in head:
+            head = {'chunks': 0, 'count': 0}
+        chunks = self.backend.mget(self.chunk_ids(from_id, from_head)[1:])
+        for chunk in chunks:
+            self.put_obj('%s.%d' % (id, head['chunks']), chunk)
+            head['chunks'] += 1
+            head['count'] += chunk.get('count', 0)
+        self.put_obj(id, head)
+
     def rename_objs(self, from_id, to_id):
-        val = self.get_list(from_id)
+        val = self.get_obj(from_id)
         if val:
-            self.put_list(to_id, val)
+            self.delete_objs([to_id])
+            self.list_extend_from(to_id, from_id)
             self.delete_objs([from_id])
 
     # Public access...
@@ -252,9 +324,11 @@ class IndexerState(object):
 
         #assert(self.get_count(self.done_set) == 0)  # Valid for cycle-level accounting only
         #undone_uuids = self.get_diff(self.todo_set, [self.done_set])  # works for any accountingu
-        undone_uuids = self.get_list(self.todo_set)                    # works fastest for cycle-level accounting
+        undone_uuids = self.get_undone()                               # todo_set less checkpointed chunks
         if len(undone_uuids) <= 0:  # TODO SEARCH_MAX?  SEARCH_MAX/10
             return (-1, [], False)
+        log.warn('%s resuming interrupted cycle, %d of %d uuids left' % (
+            self.state_id, len(undone_uuids), len(self.todo_uuids)))
 
         # Note: do not clean up last cycle yet because we could be restarted multiple times.
         return (xmin, undone_uuids, True)
@@ -280,9 +354,53 @@ class IndexerState(object):
         self.put(state)
         self.delete_objs(self.cleanup_last_cycle)
         self.delete_objs(self.cleanup_this_cycle)
-        self.put_list(self.todo_set, set(uuids))
+        self.todo_uuids = self.put_uuids(self.todo_set, uuids)
+        self.done_bits = bytearray((len(self.todo_uuids) + 7) // 8)
+        self.done_count = 0
+        return state
+
+    def resume_cycle(self, state):
+        '''Reopens an interrupted cycle, keeping its uuids and checkpoints.'''
+        self.clock = {}
+        self.start_clock('cycle')
+        state['cycle_resumed'] = datetime.datetime.now().isoformat()
+        state['status'] = 'indexing'
+        self.put(state)
         return state
 
+    def get_undone(self):
+        '''Loads the current cycle's uuids and checkpoints, returning the uuids not yet indexed.'''
+        self.todo_uuids = sorted(self.get_list(self.todo_set))
+        self.done_bits = bytearray((len(self.todo_uuids) + 7) // 8)
+        checkpoint = self.get_obj(self.checkpoint_id)
+        if checkpoint.get('count') == len(self.todo_uuids) and 'bitmap' in checkpoint:
+            self.done_bits = bytearray(unpack_bytes(checkpoint['bitmap']))
+        self.done_count = sum(bin(byte).count('1') for byte in self.done_bits)
+        return [
+            uuid for pos, uuid in enumerate(self.todo_uuids)
+            if not self.done_bits[pos >> 3] & (1 << (pos & 7))
+        ]
+
+    def checkpoint(self, uuids):
+        '''Records uuids of the current cycle as indexed, so a restart skips them.'''
+        if self.todo_uuids is None:
+            return
+        todo = self.todo_uuids
+        for uuid in uuids:
+            uuid = str(uuid)
+            pos = bisect.bisect_left(todo, uuid)
+            if pos == len(todo) or todo[pos] != uuid:
+                continue
+            bit = 1 << (pos & 7)
+            if not self.done_bits[pos >> 3] & bit:
+                self.done_bits[pos >> 3] |= bit
+                self.done_count += 1
+        self.put_obj(self.checkpoint_id, {
+            'bitmap': pack_bytes(self.done_bits),
+            'count': len(todo),
+            'done': self.done_count,
+        })
+
     def add_errors(self, errors, finished=True):
         '''To avoid 16 worker concurency issues, errors are recorded at the end of a cycle.'''
         uuids = [err['uuid'] for err in errors]  # better be uuids!
@@ -310,10 +428,9 @@ class IndexerState(object):
         # pass any staged items to followup
         if self.followup_prep_list is not None:
             # TODO: send signal for 'all' when appropriate.  Saves the following expensive lines.
-            hand_off_list = self.get_list(self.followup_prep_list)
-            if len(hand_off_list) > 0:  # Have to push because ready_list may still have previous cycles in it
+            if self.get_count(self.followup_prep_list) > 0:  # Have to push because ready_list may still have previous cycles in it
                 for id in self.followup_lists:
-                    self.list_extend(id, hand_off_list)
+                    self.list_extend_from(id, self.followup_prep_list)
                     #log.warn("prmary added to %s" % id)
                 self.delete_objs([self.followup_prep_list])
 
@@ -504,6 +621,7 @@ class IndexerState(object):
             display['state']['indexing_elapsed'] = str(datetime.datetime.now() - started)
         display['title'] = display['state'].get('title',self.state_id)
         display['uuids_in_progress'] = self.get_count(self.todo_set)
+        display['uuids_checkpointed'] = self.get_obj(self.checkpoint_id).get('done', 0)
         display['uuids_troubled'] = self.get_count(self.troubled_set)
         display['uuids_last_cycle'] = self.get_count(self.last_set)
         if self.followup_prep_list is not None:
@@ -530,6 +648,8 @@ class IndexerState(object):
         if uuids is not None:
             uuids_to_show = []
             uuid_list = self.get_obj(self.todo_set)
+            if uuid_list:
+                uuid_list['list'] = self.get_list(self.todo_set)
             if not uuid_list:
                 uuids_to_show = 'No uuids indexing'
             else:
@@ -557,7 +677,7 @@ class IndexerState(object):
 def indexer_state_show(request):
     es = request.registry[ELASTIC_SEARCH]
     INDEX = request.registry.settings['snovault.elasticsearch.index']
-    state = IndexerState(es,INDEX)
+    state = IndexerState(es,INDEX, backend=state_backend(request.registry))
 
     # requesting reindex
     reindex = request.params.get("reindex")
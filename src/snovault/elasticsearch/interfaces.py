@@ -5,6 +5,7 @@ APP_FACTORY = 'app_factory'
 ELASTIC_SEARCH = 'elasticsearch'
 SNP_SEARCH_ES = 'snp_search'
 INDEXER = 'indexer'
+SEARCH_CACHE = 'search_cache'
 
 
 class ICachedItem(Interface):
@@ -1,15 +1,22 @@
-from snovault import DBSESSION
+from snovault import (
+    CONNECTION,
+    DBSESSION,
+)
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import partial
 from multiprocessing import get_context
 from multiprocessing.pool import Pool
 from pyramid.decorator import reify
 from pyramid.request import apply_request_extensions
+from pyramid.settings import asbool
 from pyramid.threadlocal import (
     get_current_request,
     manager,
 )
 import atexit
 import logging
+import threading
 import time
 import transaction
 from .indexer import (
@@ -99,12 +106,31 @@ def snapshot(xmin, snapshot_id):
     signal.alarm(5)
 
 
-def update_object_in_snapshot(args):
-    uuid, xmin, snapshot_id, restart = args
+def update_objects_in_snapshot(args):
+    uuids, xmin, snapshot_id, restart, shared_embeds = args
+    with snapshot(xmin, snapshot_id):
+        request = get_current_request()
+        embed_cache = request.registry[CONNECTION].persistent_embed_cache
+        if embed_cache is not None:
+            embed_cache.shared = shared_embeds
+        indexer = request.registry[INDEXER]
+        # Any bulk buffer is flushed before returning, so once per chunk.
+        # Embeds were invalidated for the whole cycle by the parent.
+        stats = {}
+        errors = indexer.update_chunk(request, uuids, xmin, stats)
+        return errors, stats, uuids
+
+
+def render_objects_in_snapshot(args):
+    uuids, xmin, snapshot_id, restart, shared_embeds = args
     with snapshot(xmin, snapshot_id):
         request = get_current_request()
+        embed_cache = request.registry[CONNECTION].persistent_embed_cache
+        if embed_cache is not None:
+            embed_cache.shared = shared_embeds
         indexer = request.registry[INDEXER]
-        return indexer.update_object(request, uuid, xmin, restart)
+        # Documents are written by the parent process.
+        return indexer.render_objects(request, uuids)
 
 
 # Running in main process
@@ -115,8 +141,21 @@ class MPIndexer(Indexer):
     def __init__(self, registry, processes=None):
         super(MPIndexer, self).__init__(registry)
         self.processes = processes
-        self.chunksize = int(registry.settings.get('indexer.chunk_size',1024))  # in production.ini (via buildout.cfg) as 1024
         self.initargs = (registry[APP_FACTORY], registry.settings,)
+        # Share rendered embeds between workers for the duration of a cycle.
+        self.share_embeds = asbool(registry.settings.get('embed_cache.persistent', False)) and \
+            asbool(registry.settings.get('embed_cache.shared', False))
+        # Pipelined mode: workers only render, threads in this process write.
+        self.pipeline = asbool(registry.settings.get('indexer.pipeline', False))
+        self.write_threads = int(registry.settings.get('indexer.write_threads', 2))
+        self.pipeline_depth = int(registry.settings.get(
+            'indexer.pipeline_depth', 2 * (processes or 1) + self.write_threads))
+        # Seconds to wait for a chunk to render before giving up the cycle.
+        self.render_timeout = float(registry.settings.get('indexer.render_timeout', 3600))
+
+    @reify
+    def manager(self):
+        return get_context('forkserver').Manager()
 
     @reify
     def pool(self):
@@ -128,28 +167,153 @@ class MPIndexer(Indexer):
             context=get_context('forkserver'),
         )
 
-    def update_objects(self, request, uuids, xmin, snapshot_id, restart):
+    def update_objects(self, request, uuids, xmin, snapshot_id, restart, stats=None, checkpoint=None):
         # Ensure that we iterate over uuids in this thread not the pool task handler.
         uuid_count = len(uuids)
         workers = 1
         if self.processes is not None and self.processes > 0:
             workers = self.processes
         chunkiness = int((uuid_count - 1) / workers) + 1
-        if chunkiness > self.chunksize:
-            chunkiness = self.chunksize
+        if chunkiness > self.chunk_size:  # in production.ini (via buildout.cfg) as 1024
+            chunkiness = self.chunk_size
 
-        tasks = [(uuid, xmin, snapshot_id, restart) for uuid in uuids]
+        # Each chunk is a single task so that workers can flush bulk writes
+        # when it is done. maxtasks still applies per chunk.
+        uuids = list(uuids)
+        # Invalidated once for the whole cycle before any chunk is rendered.
+        # Workers start with empty caches and the shared dict is new for each
+        # cycle, so neither holds embeds from before it.
+        self.invalidate_embeds(request, uuids)
+        # All workers in a cycle render from the same snapshot, so embeds
+        # rendered by one are valid for the others until the cycle ends.
+        shared_embeds = self.manager.dict() if self.share_embeds else None
+        tasks = [
+            (uuids[start:start + chunkiness], xmin, snapshot_id, restart, shared_embeds)
+            for start in range(0, uuid_count, chunkiness)
+        ]
         errors = []
         try:
-            for i, error in enumerate(self.pool.imap_unordered(
-                    update_object_in_snapshot, tasks, chunkiness)):
-                if error is not None:
-                    errors.append(error)
-                if (i + 1) % 50 == 0:
-                    log.info('Indexing %d', i + 1)
+            if self.pipeline:
+                errors = self.update_objects_pipelined(tasks, xmin, stats, checkpoint)
+            else:
+                for i, (chunk_errors, chunk_stats, chunk) in enumerate(self.pool.imap_unordered(
+                        update_objects_in_snapshot, tasks)):
+                    errors.extend(chunk_errors)
+                    if checkpoint is not None:
+                        checkpoint(chunk)
+                    if stats is not None:
+                        for key, value in chunk_stats.items():
+                            stats[key] = stats.get(key, 0) + value
+                    log.info('Indexed chunk %d of %d', i + 1, len(tasks))
         except:
             self.shutdown()
             raise
+        finally:
+            if shared_embeds is not None and 'manager' in self.__dict__:
+                shared_embeds.clear()
+        return errors
+
+    def update_objects_pipelined(self, tasks, xmin, stats=None, checkpoint=None):
+        '''Renders chunks in the pool while writer threads bulk write them.
+
+        At most pipeline_depth chunks are being rendered or waiting to be
+        written at once, so a slow elasticsearch holds back rendering rather
+        than filling memory with documents.
+        '''
+        slots = threading.BoundedSemaphore(self.pipeline_depth)
+        lock = threading.Lock()
+        errors = []
+        failures = []
+        counters = {
+            'chunks': len(tasks),
+            'render_time': 0.0,
+            'write_time': 0.0,
+            'queue_depth': 0,
+            'max_queue_depth': 0,
+        }
+        bulk_size = self.bulk_size or 500
+        writers = ThreadPoolExecutor(max_workers=self.write_threads)
+
+        def write(uuids, docs):
+            try:
+                start = time.time()
+                write_stats = {}
+                for offset in range(0, len(docs), bulk_size):
+                    chunk_errors = self.flush_bulk(docs[offset:offset + bulk_size], xmin, write_stats)
+                    with lock:
+                        errors.extend(chunk_errors)
+                with lock:
+                    counters['write_time'] += time.time() - start
+                    for key, value in write_stats.items():
+                        counters[key] = counters.get(key, 0) + value
+                    if checkpoint is not None:
+                        checkpoint(uuids)
+            except Exception as e:
+                log.error('Error writing rendered documents', exc_info=True)
+                failures.append(e)
+            finally:
+                with lock:
+                    counters['queue_depth'] -= 1
+                slots.release()
+
+        def rendered(uuids, result):
+            if failures:
+                slots.release()
+                return
+            docs, render_errors, render_time = result
+            with lock:
+                errors.extend(render_errors)
+                counters['render_time'] += render_time
+                counters['queue_depth'] += 1
+                counters['max_queue_depth'] = max(counters['max_queue_depth'], counters['queue_depth'])
+            writers.submit(write, uuids, docs)
+
+        def failed(e):
+            log.error('Error rendering chunk: %r', e)
+            failures.append(e)
+            slots.release()
+
+        def acquire():
+            # A worker that dies never calls back and its slot is never
+            # released, so also watch how long each render has been pending.
+            while not slots.acquire(timeout=1):
+                if failures:
+                    return False
+                now = time.time()
+                if any(not result.ready() and now - start > self.render_timeout
+                       for start, result in pending):
+                    log.error('Rendering a chunk took longer than %s seconds', self.render_timeout)
+                    failures.append(TimeoutError(
+                        'Rendering a chunk took longer than %s seconds' % self.render_timeout))
+                    return False
+            return True
+
+        pending = []
+        try:
+            for i, task in enumerate(tasks):
+                if not acquire():
+                    break
+                if failures:
+                    slots.release()
+                    break
+                result = self.pool.apply_async(
+                    render_objects_in_snapshot, (task,),
+                    callback=partial(rendered, task[0]), error_callback=failed,
+                )
+                pending.append((time.time(), result))
+                log.info('Rendering chunk %d of %d', i + 1, len(tasks))
+            # Wait for every chunk to be written.
+            for i in range(self.pipeline_depth):
+                if not acquire():
+                    break
+        finally:
+            writers.shutdown(wait=True)
+
+        if failures:
+            raise failures[0]
+        if stats is not None:
+            del counters['queue_depth']
+            stats.update(counters)
         return errors
 
     def shutdown(self):
@@ -157,3 +321,6 @@ class MPIndexer(Indexer):
             self.pool.terminate()
             self.pool.join()
             del self.pool
+        if 'manager' in self.__dict__:
+            self.manager.shutdown()
+            del self.manager
@@ -0,0 +1,81 @@
+from elasticsearch.exceptions import TransportError
+from snovault.util import get_root_request
+from .interfaces import ELASTIC_SEARCH
+
+
+def request_searches(request):
+    """ Returns the MultiSearch shared by a request and its subrequests.
+    """
+    root = get_root_request() or request
+    searches = getattr(root, '_msearch', None)
+    if searches is None:
+        searches = root._msearch = MultiSearch(request.registry[ELASTIC_SEARCH])
+    return searches
+
+
+class DeferredSearch(object):
+    """ Result of a search added to a MultiSearch.
+    """
+    def __init__(self, searches):
+        self.searches = searches
+        self.response = None
+        self.error = None
+
+    def result(self):
+        if self.response is None and self.error is None:
+            self.searches.flush()
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class MultiSearch(object):
+    """ Collects searches so that they are sent in a single _msearch call.
+
+    Searches are queued by ``add`` and all pending searches are sent as soon
+    as the result of any one of them is needed. A single pending search is
+    sent as a plain search.
+    """
+    def __init__(self, es):
+        self.es = es
+        self.pending = []
+
+    def add(self, body, index='_all', from_=None, size=None):
+        deferred = DeferredSearch(self)
+        body = dict(body)
+        if from_ is not None:
+            body['from'] = from_
+        if size is not None:
+            body['size'] = size
+        if not isinstance(index, str):
+            index = ','.join(index)
+        self.pending.append((deferred, index, body))
+        return deferred
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if len(pending) == 1:
+            deferred, index, body = pending[0]
+            try:
+                deferred.response = self.es.search(index=index, body=body)
+            except TransportError as e:
+                deferred.error = e
+            return
+        lines = []
+        for deferred, index, body in pending:
+            lines.append({'index': index})
+            lines.append(body)
+        try:
+            responses = self.es.msearch(body=lines)['responses']
+        except TransportError as e:
+            for deferred, index, body in pending:
+                deferred.error = e
+            return
+        for (deferred, index, body), response in zip(pending, responses):
+            if 'error' in response:
+                error = response['error']
+                if isinstance(error, dict):
+                    error = error.get('type', error)
+                deferred.error = TransportError(response.get('status', 500), error, response)
+            else:
+                deferred.response = response
@@ -0,0 +1,87 @@
+from snovault.cache import SizedLRUCache
+from snovault.util import (
+    get_root_request,
+    quick_deepcopy,
+)
+from .interfaces import (
+    ELASTIC_SEARCH,
+    SEARCH_CACHE,
+)
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def includeme(config):
+    settings = config.registry.settings
+    capacity = int(settings.get('search_cache.capacity', 0))
+    if capacity > 0:
+        config.registry[SEARCH_CACHE] = SearchCache(config.registry, capacity)
+
+
+class SearchCache(object):
+    """ Process wide cache of search results and facet aggregations.
+
+    Callers include the principals in their keys. Entries are only valid
+    for the xmin of the last completed indexing cycle, read from the meta
+    index at most once every ``search_cache.xmin_interval`` seconds. When it
+    changes the cache is emptied.
+    """
+    stats_prefix = 'search_cache'
+
+    def __init__(self, registry, capacity=100):
+        settings = registry.settings
+        self.registry = registry
+        self.index = settings['snovault.elasticsearch.index']
+        self.xmin_interval = float(settings.get('search_cache.xmin_interval', 5))
+        self.cache = SizedLRUCache(
+            max_entries=capacity,
+            max_bytes=int(settings.get('search_cache.max_bytes', 64 * 1024 * 1024)),
+        )
+        self.lock = threading.Lock()
+        self.xmin = None
+        self.xmin_checked = 0
+
+    def record(self, name):
+        request = get_root_request()
+        if request is None:
+            return
+        key = '%s_%s' % (self.stats_prefix, name)
+        request._stats[key] = request._stats.get(key, 0) + 1
+
+    def indexed_xmin(self):
+        now = time.time()
+        if now - self.xmin_checked < self.xmin_interval:
+            return self.xmin
+        es = self.registry[ELASTIC_SEARCH]
+        res = es.get(index=self.index, doc_type='meta', id='indexing', ignore=[400, 404])
+        xmin = res.get('_source', {}).get('xmin') if res.get('found') else None
+        with self.lock:
+            if xmin != self.xmin:
+                self.cache.clear()
+                self.xmin = xmin
+            self.xmin_checked = now
+        return xmin
+
+    def key(self, kind, *parts):
+        return (kind, self.indexed_xmin()) + parts
+
+    def get(self, key, name='hits'):
+        with self.lock:
+            value = self.cache.get(key)
+        if value is None:
+            self.record(name.replace('hits', 'misses'))
+            return None
+        self.record(name)
+        return quick_deepcopy(value)
+
+    def set(self, key, value):
+        value = quick_deepcopy(value)
+        with self.lock:
+            self.cache[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
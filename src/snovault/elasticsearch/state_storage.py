@@ -0,0 +1,159 @@
+from snovault import DBSESSION
+from snovault.storage import IndexerStateDocument
+from uuid import UUID
+from .interfaces import ELASTIC_SEARCH
+import base64
+import logging
+import re
+import zlib
+
+log = logging.getLogger(__name__)
+
+UUID_RE = re.compile('^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+CHUNK_UUIDS = 100000  # uuids per chunk document
+
+
+def pack_bytes(data):
+    return base64.b64encode(zlib.compress(bytes(data))).decode('ascii')
+
+
+def unpack_bytes(packed):
+    return zlib.decompress(base64.b64decode(packed))
+
+
+def encode_uuids(uuids):
+    ''' Sorted, unique 16 byte uuids as varint deltas, compressed and base64 encoded.
+    '''
+    out = bytearray()
+    previous = 0
+    for value in sorted({UUID(str(uuid)).int for uuid in uuids}):
+        delta = value - previous
+        previous = value
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return pack_bytes(out)
+
+
+def decode_uuids(encoded):
+    ''' Returns the sorted list of uuid strings encoded by encode_uuids.
+    '''
+    uuids = []
+    value = 0
+    delta = 0
+    shift = 0
+    for byte in unpack_bytes(encoded):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        value += delta
+        uuids.append(str(UUID(int=value)))
+        delta = 0
+        shift = 0
+    return uuids
+
+
+def encode_chunks(values, chunk_uuids=CHUNK_UUIDS):
+    ''' Splits a list into chunk documents.
+
+    Each chunk has the non uuid strings (e.g. 'xmin:123' markers) that start
+    it as 'head', followed by a run of uuids stored with encode_uuids. Order
+    is kept between chunks, uuids within a chunk are sorted and unique.
+    '''
+    head = []
+    uuids = set()
+    for value in values:
+        value = str(value)
+        if UUID_RE.match(value) is None:
+            if uuids:
+                yield {'head': head, 'uuids': encode_uuids(uuids), 'count': len(head) + len(uuids)}
+                head = []
+                uuids = set()
+            head.append(value)
+            continue
+        uuids.add(value)
+        if len(uuids) >= chunk_uuids:
+            yield {'head': head, 'uuids': encode_uuids(uuids), 'count': len(head) + len(uuids)}
+            head = []
+            uuids = set()
+    if head or uuids:
+        yield {'head': head, 'uuids': encode_uuids(uuids), 'count': len(head) + len(uuids)}
+
+
+def decode_chunk(chunk):
+    return chunk.get('head', []) + decode_uuids(chunk['uuids'])
+
+
+class ESStateBackend(object):
+    ''' Indexer state documents in an elasticsearch index
+    '''
+    def __init__(self, es, index):
+        self.es = es
+        self.index = index
+
+    def get(self, id, doc_type='meta'):
+        try:
+            return self.es.get(index=self.index, doc_type=doc_type, id=id).get('_source', {})
+        except:
+            return {}
+
+    def mget(self, ids, doc_type='meta'):
+        if not ids:
+            return []
+        res = self.es.mget(index=self.index, doc_type=doc_type, body={'ids': list(ids)})
+        return [doc.get('_source', {}) if doc.get('found') else {} for doc in res['docs']]
+
+    def put(self, id, obj, doc_type='meta'):
+        self.es.index(index=self.index, doc_type=doc_type, id=id, body=obj)
+
+    def delete(self, id, doc_type='meta'):
+        self.es.delete(index=self.index, doc_type=doc_type, id=id)
+
+
+class SQLStateBackend(object):
+    ''' Indexer state documents in the indexer_state table
+
+    A local stand in for ESStateBackend, written through its own connections
+    as indexer transactions are read only.
+    '''
+    def __init__(self, engine):
+        self.engine = engine
+        self.table = IndexerStateDocument.__table__
+
+    def get(self, id, doc_type='meta'):
+        docs = self.mget([id], doc_type)
+        return docs[0]
+
+    def mget(self, ids, doc_type='meta'):
+        table = self.table
+        ids = list(ids)
+        if not ids:
+            return []
+        query = table.select().where((table.c.doc_type == doc_type) & table.c.id.in_(ids))
+        with self.engine.connect() as connection:
+            found = {row.id: row.data for row in connection.execute(query)}
+        return [found.get(id, {}) for id in ids]
+
+    def put(self, id, obj, doc_type='meta'):
+        table = self.table
+        with self.engine.begin() as connection:
+            connection.execute(table.delete().where(
+                (table.c.doc_type == doc_type) & (table.c.id == id)))
+            connection.execute(table.insert(), {'doc_type': doc_type, 'id': id, 'data': obj})
+
+    def delete(self, id, doc_type='meta'):
+        table = self.table
+        with self.engine.begin() as connection:
+            connection.execute(table.delete().where(
+                (table.c.doc_type == doc_type) & (table.c.id == id)))
+
+
+def state_backend(registry):
+    ''' Backend named by the indexer.state_backend setting, elasticsearch by default
+    '''
+    settings = registry.settings
+    if settings.get('indexer.state_backend', 'elasticsearch') == 'postgresql':
+        return SQLStateBackend(registry[DBSESSION].bind)
+    return ESStateBackend(registry[ELASTIC_SEARCH], settings['snovault.elasticsearch.index'])
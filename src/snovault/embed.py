@@ -9,6 +9,9 @@ from .interfaces import CONNECTION
 import logging
 log = logging.getLogger(__name__)
 
+# Frames whose results may be kept in the persistent embed cache.
+PERSISTENT_FRAMES = ('@@object', '@@embedded')
+
 
 def includeme(config):
     config.scan(__name__)
@@ -60,7 +63,7 @@ def embed(request, *elements, **kw):
     else:
         cached = embed_cache.get(path, None)
         if cached is None:
-            cached = _embed(request, path)
+            cached = _embed_persistent(request, path)
             embed_cache[path] = cached
         result, embedded, linked = cached
         result = quick_deepcopy(result)
@@ -69,6 +72,18 @@ def embed(request, *elements, **kw):
     return result
 
 
+def _embed_persistent(request, path):
+    connection = request.registry[CONNECTION]
+    cache = connection.persistent_embed_cache
+    if cache is None or not path.endswith(PERSISTENT_FRAMES):
+        return _embed(request, path)
+    cached = cache.get(path, connection)
+    if cached is None:
+        cached = _embed(request, path)
+        cache.set(path, cached, connection)
+    return cached
+
+
 def _embed(request, path, as_user='EMBED'):
     subreq = make_subrequest(request, path)
     subreq.override_renderer = 'null_renderer'
@@ -34,7 +34,7 @@ def record_updated_uuid_paths(event):
 def record_initial_back_revs(event):
     context = event.object
     initial = event.request._initial_back_rev_links
-    properties = context.upgrade_properties()
+    properties = context.upgrade_properties(copy=False)
     initial[context.uuid] = {
         path: set(simple_path_ids(properties, path))
         for path in context.type_info.merged_back_rev
@@ -51,7 +51,7 @@ def invalidate_new_back_revs(event):
     context = event.object
     updated = event.request._updated_uuid_paths
     initial = event.request._initial_back_rev_links.get(context.uuid, {})
-    properties = context.upgrade_properties()
+    properties = context.upgrade_properties(copy=False)
     current = {
         path: set(simple_path_ids(properties, path))
         for path in context.type_info.merged_back_rev
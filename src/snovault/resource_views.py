@@ -149,9 +149,13 @@ def uuid_to_path(request, obj, path):
         return
     conn = request.registry[CONNECTION]
     if isinstance(value, list):
+        items = conn.get_by_uuids(value)
+        for v, item in zip(value, items):
+            if item is None:
+                raise KeyError(v)
         obj[name] = [
-            request.resource_path(conn[v])
-            for v in value
+            request.resource_path(item)
+            for item in items
         ]
     else:
         obj[name] = request.resource_path(conn[value])
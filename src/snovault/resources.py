@@ -2,12 +2,16 @@
 import logging
 from collections import Mapping
 from pyramid.decorator import reify
-from pyramid.httpexceptions import HTTPInternalServerError
+from pyramid.httpexceptions import (
+    HTTPConflict,
+    HTTPInternalServerError,
+)
 from pyramid.security import (
     Allow,
     Everyone,
 )
 from pyramid.traversal import resource_path
+from types import MappingProxyType
 from .calculated import (
     calculate_properties,
     calculated_property,
@@ -19,15 +23,28 @@ from .interfaces import (
     TYPES,
     UPGRADER,
 )
+from .cache import SizedLRUCache
 from .validation import ValidationFailure
 from .util import (
     ensurelist,
+    get_root_request,
     quick_deepcopy,
     simple_path_ids,
 )
 
 logger = logging.getLogger(__name__)
 
+UPGRADE_MEMO_SIZE = 1000
+
+
+def record_upgrade_stat(name):
+    request = get_root_request()
+    stats = getattr(request, '_stats', None)
+    if stats is None:
+        return
+    key = 'upgrade_properties_%s' % name
+    stats[key] = stats.get(key, 0) + 1
+
 
 def includeme(config):
     config.scan(__name__)
@@ -162,7 +179,10 @@ class AbstractCollection(Resource, Mapping):
             resource.type_info.name in resource.type_info.subtypes
 
     def get(self, name, default=None):
-        resource = self.connection.get_by_uuid(name, None)
+        item_type = None
+        if len(self.type_info.subtypes) == 1:
+            item_type = self.type_info.item_type
+        resource = self.connection.get_by_uuid(name, None, item_type=item_type)
         if resource is not None:
             if not self._allow_contained(resource):
                 return default
@@ -204,6 +224,8 @@ class Item(Resource):
     embedded = ()
     audit_inherit = None
     schema = None
+    # Set by create_many to collect writes instead of making them
+    _batch = None
     AbstractCollection = AbstractCollection
     Collection = Collection
 
@@ -267,10 +289,50 @@ class Item(Resource):
             for name, props in self.type_info.schema_keys.items()
         }
 
-    def upgrade_properties(self):
-        properties = quick_deepcopy(self.properties)
-        current_version = properties.get('schema_version', '')
+    def upgrade_properties(self, copy=True):
+        """ The stored properties upgraded to the current schema version.
+
+        Upgraded properties are built from a private copy of the stored
+        properties. A copy is returned unless copy is False. Then a read only
+        view of upgraded properties memoized for the request by uuid, tid and
+        schema version is returned. Only its top level is read only. Nested
+        lists and dicts are shared by every copy=False caller in the request
+        and must not be modified. Copies are made from the memo when it holds
+        the properties, so each call makes at most one deep copy.
+        """
+        properties, shared = self._upgraded_properties(memoize=not copy)
+        if not copy:
+            return MappingProxyType(properties)
+        if not shared:
+            return properties
+        record_upgrade_stat('copies')
+        return quick_deepcopy(properties)
+
+    def _upgraded_properties(self, memoize=False):
+        """ Returns (properties, shared), shared if held by the request memo.
+
+        Newly upgraded properties are only added to the memo if memoize.
+        """
+        request = get_root_request()
+        memo = None
+        if request is not None:
+            memo = getattr(request, '_upgraded_properties', None)
+            if memo is None and memoize:
+                memo = request._upgraded_properties = SizedLRUCache(
+                    max_entries=UPGRADE_MEMO_SIZE, sizeof=lambda entry: 0)
+        source = self.properties
         target_version = self.type_info.schema_version
+        if memo is not None:
+            key = (str(self.uuid), self.tid, target_version)
+            entry = memo.get(key)
+            # The tid is unchanged by a second update in the same transaction
+            if entry is not None and entry[0] is source:
+                record_upgrade_stat('memo_hits')
+                return entry[1], True
+
+        properties = quick_deepcopy(source)
+        record_upgrade_stat('copies')
+        current_version = properties.get('schema_version', '')
         if target_version is not None and current_version != target_version:
             upgrader = self.registry[UPGRADER]
             try:
@@ -284,7 +346,10 @@ class Item(Resource):
                     'Unable to upgrade %s from %r to %r',
                     resource_path(self.__parent__, self.uuid),
                     current_version, target_version, exc_info=True)
-        return properties
+        if memo is None or not memoize:
+            return properties, False
+        memo[key] = (source, properties)
+        return properties, True
 
     def __json__(self, request):
         # Record embedding objects
@@ -303,9 +368,84 @@ class Item(Resource):
         self._update(properties, sheets)
         return self
 
+    @classmethod
+    def create_many(cls, registry, items):
+        """ Create items from (uuid, properties) pairs with batched writes.
+
+        Each item still goes through _update, which adds its write to the
+        batch rather than making it. Returns a list in input order holding the
+        new item, or the ValidationFailure or HTTPConflict for an item that
+        was not created.
+        """
+        connection = registry[CONNECTION]
+        results = []
+        for uuid, properties in items:
+            item = cls(registry, connection.create(cls.__name__, uuid))
+            try:
+                unique_keys, links = item._prepare(properties)
+            except ValidationFailure as e:
+                results.append(e)
+                continue
+            results.append((item, properties, unique_keys))
+
+        # Conflicts with existing items and earlier items in the batch
+        prepared = [result for result in results if isinstance(result, tuple)]
+        uuids = [item.uuid for item, _, _ in prepared]
+        existing = set()
+        for uuid, found in zip(uuids, connection.get_by_uuids(uuids)):
+            if found is not None:
+                existing.add(uuid)
+        pairs = list({
+            (k, v) for _, _, unique_keys in prepared
+            for k, values in unique_keys.items() for v in values
+        })
+        existing.update(
+            pair for pair, found in zip(pairs, connection.get_by_unique_keys(pairs))
+            if found is not None)
+
+        batch = []
+        batched = []
+        for i, result in enumerate(results):
+            if not isinstance(result, tuple):
+                continue
+            item, properties, unique_keys = result
+            keys = [item.uuid] + [(k, v) for k, values in unique_keys.items() for v in values]
+            conflicts = [key for key in keys if key in existing]
+            existing.update(keys)
+            if conflicts:
+                msg = 'UUID or keys conflict: %r' % conflicts
+                results[i] = HTTPConflict(msg)
+                continue
+            start = len(batch)
+            item._batch = batch
+            try:
+                item._update(properties)
+            except ValidationFailure as e:
+                del batch[start:]
+                results[i] = e
+                continue
+            finally:
+                del item._batch
+            results[i] = item
+            batched.extend([i] * (len(batch) - start))
+
+        if batch:
+            for i, error in zip(batched, connection.create_many(batch)):
+                if error is not None:
+                    results[i] = error
+        return results
+
     def update(self, properties, sheets=None):
         self._update(properties, sheets)
 
+    def _prepare(self, properties):
+        unique_keys = self.unique_keys(properties)
+        for k, values in unique_keys.items():
+            if len(set(values)) != len(values):
+                msg = "Duplicate keys for %r: %r" % (k, values)
+                raise ValidationFailure('body', [], msg)
+        return unique_keys, self.links(properties)
+
     def _update(self, properties, sheets=None):
         unique_keys = None
         links = None
@@ -314,14 +454,11 @@ class Item(Resource):
                 properties = properties.copy()
                 del properties['uuid']
 
-            unique_keys = self.unique_keys(properties)
-            for k, values in unique_keys.items():
-                if len(set(values)) != len(values):
-                    msg = "Duplicate keys for %r: %r" % (k, values)
-                    raise ValidationFailure('body', [], msg)
-
-            links = self.links(properties)
+            unique_keys, links = self._prepare(properties)
 
+        if self._batch is not None:
+            self._batch.append((self.model, properties, sheets, unique_keys, links))
+            return
         connection = self.registry[CONNECTION]
         connection.update(self.model, properties, sheets, unique_keys, links)
 
@@ -9,17 +9,23 @@ import json
 import codecs
 import collections
 import copy
+import threading
 from jsonschema_serialize_fork import (
     Draft4Validator,
     FormatChecker,
     RefResolver,
 )
 from jsonschema_serialize_fork.exceptions import ValidationError
+from past.builtins import basestring
 from uuid import UUID
-from .util import ensurelist
+from .util import (
+    ensurelist,
+    prefetch_paths,
+)
 
 
 SERVER_DEFAULTS = {}
+NOT_LOADED = object()
 
 
 def server_default(func):
@@ -63,6 +69,81 @@ def mixinProperties(schema, resolver):
     return schema
 
 
+def collect_links(schema, instance, links):
+    """ Append (linkTo, value) for the link values in an instance.
+
+    Only plain properties and items are followed.
+    """
+    if isinstance(instance, dict):
+        properties = schema.get('properties', {})
+        for name, value in instance.items():
+            subschema = properties.get(name)
+            if subschema is not None:
+                collect_links(subschema, value, links)
+    elif isinstance(instance, list):
+        items = schema.get('items')
+        if isinstance(items, dict):
+            for value in instance:
+                collect_links(items, value, links)
+    elif isinstance(instance, basestring):
+        linkTo = schema.get('linkTo')
+        if linkTo is not None:
+            links.append((linkTo, instance))
+
+
+def prefetch_links(request, links):
+    """ Load the items for link values by uuid and unique key in batches.
+    """
+    # avoid circular import
+    from snovault import COLLECTIONS
+    collections = request.registry[COLLECTIONS]
+    paths = set()
+    for linkTo, value in links:
+        collection = None
+        if isinstance(linkTo, basestring):
+            collection = collections.get(linkTo)
+        if collection is None or value.startswith('/'):
+            paths.add(value)
+        else:
+            paths.add('/%s/%s/' % (collection.__name__, value))
+    prefetch_paths(request, paths)
+
+
+def resolve_link(validator, base, instance):
+    resolved = validator._resolved_links
+    key = (id(base), instance)
+    if resolved is not None and key in resolved:
+        return resolved[key]
+    try:
+        item = find_resource(base, instance.replace(':', '%3A'))
+    except KeyError:
+        item = None
+    if resolved is not None:
+        resolved[key] = item
+    return item
+
+
+def user_submits_for(validator, request):
+    """ The submitting user's submits_for, looked up once per validation.
+    """
+    if validator._submits_for is not NOT_LOADED:
+        return validator._submits_for
+    submits_for = None
+    userid = None
+    for principal in request.effective_principals:
+        if principal.startswith('userid.'):
+            userid = principal[len('userid.'):]
+            break
+    if userid is not None:
+        user = request.root[userid]
+        submits_for = user.upgrade_properties(copy=False).get('submits_for')
+        if submits_for is not None:
+            submits_for = {UUID(uuid) for uuid in submits_for}
+    if validator._resolved_links is not None:
+        validator._submits_for = submits_for
+    return submits_for
+
+
 def linkTo(validator, linkTo, instance, schema):
     # avoid circular import
     from snovault import Item, COLLECTIONS
@@ -79,11 +160,8 @@ def linkTo(validator, linkTo, instance, schema):
         base = request.root
     else:
         raise Exception("Bad schema")  # raise some sort of schema error
-    try:
-        item = find_resource(base, instance.replace(':', '%3A'))
-        if item is None:
-            raise KeyError()
-    except KeyError:
+    item = resolve_link(validator, base, instance)
+    if item is None:
         error = "%r not found" % instance
         yield ValidationError(error)
         return
@@ -108,20 +186,13 @@ def linkTo(validator, linkTo, instance, schema):
             return
 
     if schema.get('linkSubmitsFor'):
-        userid = None
-        for principal in request.effective_principals:
-            if principal.startswith('userid.'):
-                userid = principal[len('userid.'):]
-                break
-        if userid is not None:
-            user = request.root[userid]
-            submits_for = user.upgrade_properties().get('submits_for')
-            if (submits_for is not None and
-                    not any(UUID(uuid) == item.uuid for uuid in submits_for) and
-                    not request.has_permission('submit_for_any')):
-                error = "%r is not in user submits_for" % instance
-                yield ValidationError(error)
-                return
+        submits_for = user_submits_for(validator, request)
+        if (submits_for is not None and
+                item.uuid not in submits_for and
+                not request.has_permission('submit_for_any')):
+            error = "%r is not in user submits_for" % instance
+            yield ValidationError(error)
+            return
 
     # And normalize the value to a uuid
     if validator._serialize:
@@ -282,6 +353,25 @@ class SchemaValidator(Draft4Validator):
     VALIDATORS['validators'] = validators
     SERVER_DEFAULTS = SERVER_DEFAULTS
 
+    _resolved_links = None
+    _submits_for = NOT_LOADED
+
+    def serialize(self, instance, *args, **kw):
+        # Links are resolved together up front, then looked up once each
+        self._resolved_links = {}
+        self._submits_for = NOT_LOADED
+        request = get_current_request()
+        if request is not None:
+            links = []
+            collect_links(self.schema, instance, links)
+            if len(links) > 1:
+                prefetch_links(request, links)
+        try:
+            return super(SchemaValidator, self).serialize(instance, *args, **kw)
+        finally:
+            self._resolved_links = None
+            self._submits_for = NOT_LOADED
+
 
 format_checker = FormatChecker()
 
@@ -303,10 +393,38 @@ def load_schema(filename):
     return schema
 
 
-def validate(schema, data, current=None):
+def make_validator(schema):
     resolver = NoRemoteResolver.from_schema(schema)
-    sv = SchemaValidator(schema, resolver=resolver, serialize=True, format_checker=format_checker)
-    validated, errors = sv.serialize(data)
+    return SchemaValidator(schema, resolver=resolver, serialize=True, format_checker=format_checker)
+
+
+class CachedSchemaValidator(object):
+    """ Reuses compiled SchemaValidators for a schema.
+
+    A SchemaValidator keeps the state of the current validation on itself
+    (and its resolver), so validators are kept per thread and one is only
+    reused once its validation has finished. A nested validation against the
+    same schema gets another validator.
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        self.local = threading.local()
+
+    def serialize(self, instance):
+        free = getattr(self.local, 'free', None)
+        if free is None:
+            free = self.local.free = []
+        validator = free.pop() if free else make_validator(self.schema)
+        result = validator.serialize(instance)
+        # Not returned on error as its state may be left inconsistent
+        free.append(validator)
+        return result
+
+
+def validate(schema, data, current=None, validator=None):
+    if validator is None:
+        validator = make_validator(schema)
+    validated, errors = validator.serialize(data)
 
     filtered_errors = []
     for error in errors:
@@ -329,11 +447,11 @@ def validate(schema, data, current=None):
     return validated, filtered_errors
 
 
-def validate_request(schema, request, data=None, current=None):
+def validate_request(schema, request, data=None, current=None, validator=None):
     if data is None:
         data = request.json
 
-    validated, errors = validate(schema, data, current)
+    validated, errors = validate(schema, data, current, validator)
     for error in errors:
         request.errors.add('body', list(error.path), error.message)
 
@@ -6,10 +6,12 @@ from sqlalchemy import (
     bindparam,
     event,
     func,
+    inspect,
     null,
     orm,
     schema,
     text,
+    tuple_,
     types,
 )
 from sqlalchemy.dialects import postgresql
@@ -86,13 +88,40 @@ class RDBStorage(object):
     def read(self):
         return self
 
-    def get_by_uuid(self, rid, default=None):
+    def get_by_uuid(self, rid, default=None, item_type=None):
+        # item_type only routes elasticsearch lookups
         session = self.DBSession()
         model = baked_query_resource(session).get(uuid.UUID(rid))
         if model is None:
             return default
         return model
 
+    def get_by_uuids(self, rids):
+        """ Load the resources for rids with one query per batch.
+
+        Current property sheets are eagerly joined, so rendering the
+        returned models issues no further queries for their properties.
+        """
+        session = self.DBSession()
+        rids = [uuid.UUID(str(rid)) for rid in rids]
+        models = []
+        for start in range(0, len(rids), self.batchsize):
+            batch = rids[start:start + self.batchsize]
+            models.extend(session.query(Resource).filter(Resource.rid.in_(batch)))
+        return models
+
+    def get_link_targets(self, rids):
+        """ Return the distinct targets of links from rids.
+        """
+        session = self.DBSession()
+        rids = [uuid.UUID(str(rid)) for rid in rids]
+        targets = set()
+        for start in range(0, len(rids), self.batchsize):
+            batch = rids[start:start + self.batchsize]
+            query = session.query(Link.target_rid).filter(Link.source_rid.in_(batch))
+            targets.update(target for target, in query)
+        return targets
+
     def get_by_unique_key(self, unique_key, name, default=None):
         session = self.DBSession()
         try:
@@ -102,6 +131,33 @@ class RDBStorage(object):
         else:
             return key.resource
 
+    def get_by_unique_keys(self, pairs):
+        """ Load the resources for (unique_key, name) pairs.
+
+        One query is made per unique key and batch of names. Returns a dict
+        of the pairs found to their resource.
+        """
+        session = self.DBSession()
+        names_by_key = {}
+        for unique_key, name in pairs:
+            names_by_key.setdefault(unique_key, set()).add(name)
+        found = {}
+        for unique_key, names in names_by_key.items():
+            names = sorted(names)
+            for start in range(0, len(names), self.batchsize):
+                batch = names[start:start + self.batchsize]
+                query = session.query(Key).options(
+                    orm.joinedload_all(
+                        Key.resource,
+                        Resource.data,
+                        CurrentPropertySheet.propsheet,
+                        innerjoin=True,
+                    ),
+                ).filter(Key.name == unique_key, Key.value.in_(batch))
+                for key in query:
+                    found[(unique_key, key.value)] = key.resource
+        return found
+
     def get_rev_links(self, model, rel, *item_types):
         if item_types:
             return [
@@ -142,10 +198,17 @@ class RDBStorage(object):
         try:
             session.add(model)
             self._update_properties(model, properties, sheets)
+            # Diffs are taken before the flush, so new items need no queries
             if links is not None:
-                self._update_rels(model, links)
+                rels_add, rels_remove = self._diff_rels(model, links)
             if unique_keys is not None:
-                keys_add, keys_remove = self._update_keys(model, unique_keys)
+                keys_add, keys_remove = self._diff_keys(model, unique_keys)
+            # Rows are written before the link and key statements below
+            session.flush()
+            if links is not None:
+                self._update_rels(model, rels_add, rels_remove)
+            if unique_keys is not None:
+                self._update_keys(model, keys_add, keys_remove)
             sp.commit()
         except (IntegrityError, FlushError):
             sp.rollback()
@@ -157,8 +220,10 @@ class RDBStorage(object):
             session.add(model)
             self._update_properties(model, properties, sheets)
             if links is not None:
-                self._update_rels(model, links)
+                rels_add, rels_remove = self._diff_rels(model, links)
             session.flush()
+            if links is not None:
+                self._update_rels(model, rels_add, rels_remove)
         except (IntegrityError, FlushError):
             msg = 'UUID conflict'
             raise HTTPConflict(msg)
@@ -168,6 +233,62 @@ class RDBStorage(object):
         msg = 'Keys conflict: %r' % conflicts
         raise HTTPConflict(msg)
 
+    def create_many(self, records):
+        """ Write new resources together.
+
+        records are (model, properties, sheets, unique_keys, links) tuples.
+        Resources and property sheets are written by one flush and keys and
+        links by multi-row inserts of up to batchsize rows. If the batch
+        conflicts, e.g. with a concurrent writer, its records are retried one
+        at a time. Returns None or the HTTPConflict for each record, in order.
+        """
+        for model, properties, sheets, unique_keys, links in records:
+            self._update_properties(model, properties, sheets)
+        try:
+            self._insert_many(records)
+        except HTTPConflict as e:
+            if len(records) == 1:
+                return [e]
+        else:
+            return [None] * len(records)
+        results = []
+        for record in records:
+            try:
+                self._insert_many([record])
+            except HTTPConflict as e:
+                results.append(e)
+            else:
+                results.append(None)
+        return results
+
+    def _insert_many(self, records):
+        session = self.DBSession()
+        keys = []
+        links = []
+        # Pending writes outside the batch are flushed before the savepoint
+        sp = session.begin_nested()
+        try:
+            for model, properties, sheets, unique_keys, model_links in records:
+                session.add(model)
+                keys.extend(
+                    {'name': name, 'value': value, 'rid': model.rid}
+                    for name, values in (unique_keys or {}).items() for value in values
+                )
+                links.extend(
+                    {'source': model.rid, 'rel': rel, 'target': uuid.UUID(str(target))}
+                    for rel, targets in (model_links or {}).items() for target in targets
+                )
+            session.flush()
+            for table, rows in [(Key.__table__, keys), (Link.__table__, links)]:
+                for start in range(0, len(rows), self.batchsize):
+                    session.execute(table.insert().values(rows[start:start + self.batchsize]))
+            sp.commit()
+        except (IntegrityError, FlushError):
+            # Models added in the savepoint are expunged, keeping their state
+            sp.rollback()
+            msg = 'UUID or keys conflict'
+            raise HTTPConflict(msg)
+
     def delete_by_uuid(self, rid):
         # WARNING USE WITH CARE PERMANENTLY DELETES RESOURCES
         session = self.DBSession()
@@ -194,52 +315,71 @@ class RDBStorage(object):
             for key, value in sheets.items():
                 model.propsheets[key] = value
 
-    def _update_keys(self, model, unique_keys):
+    def _diff_keys(self, model, unique_keys):
         keys_set = {(k, v) for k, values in unique_keys.items() for v in values}
-
-        existing = {
-            (key.name, key.value)
-            for key in model.unique_keys
-        }
-
-        to_remove = existing - keys_set
-        to_add = keys_set - existing
-
+        existing = set()
+        if inspect(model).has_identity:
+            session = self.DBSession()
+            existing = set(session.query(Key.name, Key.value).filter(Key.rid == model.rid))
+        return keys_set - existing, existing - keys_set
+
+    def _update_keys(self, model, to_add, to_remove):
+        """ Apply a key diff with one DELETE and one multi-row INSERT.
+        """
         session = self.DBSession()
-        for pk in to_remove:
-            key = session.query(Key).get(pk)
-            session.delete(key)
-
-        for name, value in to_add:
-            key = Key(rid=model.rid, name=name, value=value)
-            session.add(key)
-
+        table = Key.__table__
+        if to_remove:
+            session.execute(table.delete().where(
+                (table.c.rid == model.rid) &
+                tuple_(table.c.name, table.c.value).in_(sorted(to_remove))))
+        if to_add:
+            session.execute(table.insert().values([
+                {'name': name, 'value': value, 'rid': model.rid}
+                for name, value in sorted(to_add)
+            ]))
+        if to_add or to_remove:
+            session.expire(model, ['unique_keys'])
+            self._expunge_deleted(session, Key, to_remove)
         return to_add, to_remove
 
-    def _update_rels(self, model, links):
+    def _diff_rels(self, model, links):
+        rels = {(k, uuid.UUID(target)) for k, targets in links.items() for target in targets}
+        existing = set()
+        if inspect(model).has_identity:
+            session = self.DBSession()
+            existing = set(
+                session.query(Link.rel, Link.target_rid).filter(Link.source_rid == model.rid))
+        return rels - existing, existing - rels
+
+    def _update_rels(self, model, to_add, to_remove):
+        """ Apply a link diff with one DELETE and one multi-row INSERT.
+        """
         session = self.DBSession()
         source = model.rid
-
-        rels = {(k, uuid.UUID(target)) for k, targets in links.items() for target in targets}
-
-        existing = {
-            (link.rel, link.target_rid)
-            for link in model.rels
-        }
-
-        to_remove = existing - rels
-        to_add = rels - existing
-
-        for rel, target in to_remove:
-            link = session.query(Link).get((source, rel, target))
-            session.delete(link)
-
-        for rel, target in to_add:
-            link = Link(source_rid=source, rel=rel, target_rid=target)
-            session.add(link)
+        table = Link.__table__
+
+        if to_remove:
+            session.execute(table.delete().where(
+                (table.c.source == source) &
+                tuple_(table.c.rel, table.c.target).in_(sorted(to_remove))))
+        if to_add:
+            session.execute(table.insert().values([
+                {'source': source, 'rel': rel, 'target': target}
+                for rel, target in sorted(to_add)
+            ]))
+        if to_add or to_remove:
+            session.expire(model, ['rels'])
+            self._expunge_deleted(session, Link, ((source, rel, target) for rel, target in to_remove))
 
         return to_add, to_remove
 
+    def _expunge_deleted(self, session, cls, pks):
+        # Rows deleted by statement are still in the identity map
+        for pk in pks:
+            obj = session.identity_map.get(orm.util.identity_key(cls, pk))
+            if obj is not None:
+                session.expunge(obj)
+
 
 class UUID(types.TypeDecorator):
     """Platform-independent UUID type.
@@ -404,6 +544,30 @@ class Link(Base):
         'Resource', foreign_keys=[target_rid], backref=backref('revs', cascade='all, delete-orphan'))
 
 
+class IndexerStateDocument(Base):
+    """ indexer state documents, when not kept in elasticsearch
+    """
+    __tablename__ = 'indexer_state'
+    doc_type = Column(types.String, primary_key=True)
+    id = Column(types.String, primary_key=True)
+    data = Column(JSON)
+
+
+class IndexDependency(Base):
+    """ reverse dependencies of indexed documents
+
+    Derived from the embedded_uuids / linked_uuids of each document at index
+    time, so no foreign keys. rel is 'embedded' or 'linked'.
+    """
+    __tablename__ = 'index_dependencies'
+    source_rid = Column('source', UUID, primary_key=True)
+    rel = Column(types.String, primary_key=True)
+    target_rid = Column('target', UUID, primary_key=True)
+    __table_args__ = (
+        schema.Index('ix_index_dependencies_target_rel', 'target', 'rel'),
+    )
+
+
 class PropertySheet(Base):
     '''A triple describing a resource
     '''
@@ -204,3 +204,46 @@ def test_download_create_w_wrong_md5sum(testapp):
         'md5sum': 'deadbeef',
     }}
     testapp.post_json(url, item, status=422)
+
+
+def test_download_bulk_create(testapp):
+    from base64 import b64decode
+    items = [
+        {'attachment': {'download': 'red-dot.png', 'href': RED_DOT}},
+        {'attachment': {'download': 'red-dot.png', 'href': RED_DOT, 'md5sum': 'deadbeef'}},
+    ]
+    res = testapp.post_json('/testing-downloads/@@bulk', items, status=200)
+    results = res.json['@graph']
+    assert [result['status'] for result in results] == ['success', 'error']
+    url = '/testing-downloads/%s/' % results[0]['uuid']
+    attachment = testapp.get(url).json['attachment']
+    assert attachment['href'] == '@@download/attachment/red-dot.png'
+    assert attachment['md5sum'] == 'b60ab2708daec7685f3d412a5e05191a'
+    res = testapp.get(url + attachment['href'])
+    assert res.body == b64decode(RED_DOT.split(',', 1)[1])
+
+
+def test_upgrade_properties_view_is_not_stored(testapp, testing_download, root, threadlocals):
+    from pyramid.traversal import find_resource
+    item = find_resource(root, testing_download)
+    view = item.upgrade_properties(copy=False)
+    with pytest.raises(TypeError):
+        view['attachment'] = {}
+    assert view['attachment'] == item.properties['attachment']
+    assert view['attachment'] is not item.properties['attachment']
+    assert item.upgrade_properties(copy=False)['attachment'] is view['attachment']
+    assert item.upgrade_properties()['attachment'] is not view['attachment']
+
+
+def test_upgrade_properties_copies_once(testapp, testing_download, root, threadlocals, dummy_request):
+    from pyramid.traversal import find_resource
+    item = find_resource(root, testing_download)
+    dummy_request._stats = {}
+    item.upgrade_properties()
+    assert dummy_request._stats == {'upgrade_properties_copies': 1}
+    item.upgrade_properties(copy=False)
+    item.upgrade_properties()
+    assert dummy_request._stats == {
+        'upgrade_properties_copies': 3,
+        'upgrade_properties_memo_hits': 1,
+    }
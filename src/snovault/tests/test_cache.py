@@ -0,0 +1,85 @@
+import pytest
+
+
+def test_lru_cache_evicts_least_recently_used():
+    from snovault.cache import SizedLRUCache
+    cache = SizedLRUCache(max_entries=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.evictions == 1
+    assert cache.hits == 1
+
+
+def test_lru_cache_max_bytes():
+    from snovault.cache import SizedLRUCache
+    cache = SizedLRUCache(max_bytes=1000)
+    for i in range(50):
+        cache[i] = 'x' * 100
+    assert 0 < cache.bytes <= 1000
+    assert cache.evictions == 50 - len(cache)
+    assert 49 in cache
+
+
+def test_lru_cache_on_evict():
+    from snovault.cache import SizedLRUCache
+    evicted = []
+    cache = SizedLRUCache(max_entries=1, on_evict=lambda key, value: evicted.append((key, value)))
+    cache['a'] = 1
+    cache['b'] = 2
+    assert evicted == [('a', 1)]
+
+
+def test_two_queue_cache_scan_resistant():
+    from snovault.cache import SizedTwoQueueCache
+    cache = SizedTwoQueueCache(max_entries=4)
+    cache['hot'] = 1
+    for i in range(3):
+        cache[i] = i
+    # Evicted from the first queue, so the next store promotes it.
+    assert 'hot' not in cache
+    cache['hot'] = 1
+    for i in range(100):
+        cache['scan', i] = i
+    assert cache.get('hot') == 1
+    assert len(cache) == 4
+
+
+def test_make_cache_unknown_policy():
+    from snovault.cache import make_cache
+    with pytest.raises(ValueError):
+        make_cache('mru')
+
+
+def test_search_cache_cleared_on_new_xmin():
+    from snovault.elasticsearch.interfaces import ELASTIC_SEARCH
+    from snovault.elasticsearch.search_cache import SearchCache
+
+    class FakeES(object):
+        xmin = 1
+
+        def get(self, **kw):
+            return {'found': True, '_source': {'xmin': self.xmin}}
+
+    class FakeRegistry(dict):
+        settings = {
+            'snovault.elasticsearch.index': 'snovault',
+            'search_cache.xmin_interval': 0,
+        }
+
+    es = FakeES()
+    registry = FakeRegistry({ELASTIC_SEARCH: es})
+    cache = SearchCache(registry, capacity=10)
+    key = cache.key('search', '/search/', 'type=Item')
+    value = {'@graph': [{'uuid': 'a'}]}
+    cache.set(key, value)
+    cached = cache.get(cache.key('search', '/search/', 'type=Item'))
+    assert cached == value
+    cached['@graph'].append({})
+    assert cache.get(key) == value
+    es.xmin = 2
+    assert cache.get(cache.key('search', '/search/', 'type=Item')) is None
+    assert not cache.cache.entries
@@ -68,3 +68,33 @@ def test_updated_target(content, testapp):
     url = '/testing-link-targets/' + targets[0]['uuid']
     res = testapp.patch_json(url, {})
     assert set(res.headers['X-Updated'].split(',')) == {targets[0]['uuid']}
+
+
+@pytest.fixture
+def persistent_embed_cache(connection, monkeypatch):
+    from snovault.cache import PersistentEmbedCache
+    cache = PersistentEmbedCache()
+    monkeypatch.setattr(connection, 'persistent_embed_cache', cache)
+    return cache
+
+
+def test_persistent_embed_cache(content, connection, persistent_embed_cache, dummy_request, threadlocals):
+    path = '/testing-link-sources/%s/@@object' % sources[0]['uuid']
+    dummy_request.embed(path)
+    assert persistent_embed_cache.get(path, connection) is not None
+    assert dummy_request._stats['persistent_embed_cache_misses'] == 1
+    result, embedded, linked = persistent_embed_cache.get(path, connection)
+    assert result['name'] == 'A'
+    assert linked == {sources[0]['uuid'], targets[0]['uuid']}
+    persistent_embed_cache.invalidate([targets[0]['uuid']])
+    assert persistent_embed_cache.get(path, connection) is None
+
+
+def test_persistent_embed_cache_stale_tid(content, connection, persistent_embed_cache, dummy_request, threadlocals):
+    path = '/testing-link-sources/%s/@@object' % sources[0]['uuid']
+    dummy_request.embed(path)
+    entry = persistent_embed_cache.entries.peek(path)
+    stale = entry[:3] + (tuple((uuid, 'stale') for uuid, tid in entry[3]),)
+    persistent_embed_cache.entries[path] = stale
+    assert persistent_embed_cache.get(path, connection) is None
+    assert path not in persistent_embed_cache.entries
@@ -0,0 +1,62 @@
+UUID = '4a3ad8f0-4b89-4b3e-a1b2-6b4c1ab1c1f0'
+
+
+class FakeES(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def get(self, index, doc_type, id, ignore=None):
+        self.calls.append(('get', index))
+        source = self.docs.get((index, id))
+        if source is None:
+            return {'_index': index, '_id': id, 'found': False}
+        return {'_index': index, '_id': id, '_version': 5, 'found': True, '_source': source}
+
+    def search(self, index, body, **kw):
+        self.calls.append(('search', index))
+        ids = body['query']['ids']['values']
+        hits = [
+            {'_index': doc_index, '_id': id, '_version': 5, '_source': source}
+            for (doc_index, id), source in self.docs.items() if id in ids
+        ]
+        return {'hits': {'total': len(hits), 'hits': hits}}
+
+
+def test_get_by_uuid_routed_to_item_type_index():
+    from snovault.elasticsearch.esstorage import ElasticSearchStorage
+    es = FakeES({('snowball', UUID): {'uuid': UUID, 'item_type': 'snowball'}})
+    storage = ElasticSearchStorage(es, '_all')
+    model = storage.get_by_uuid(UUID, item_type='snowball')
+    assert model.uuid == UUID
+    assert model.hit['_version'] == 5
+    assert es.calls == [('get', 'snowball')]
+
+
+def test_get_by_uuid_other_type_falls_back_to_ids():
+    from snovault.elasticsearch.esstorage import ElasticSearchStorage
+    es = FakeES({('lab', UUID): {'uuid': UUID, 'item_type': 'lab'}})
+    storage = ElasticSearchStorage(es, '_all')
+    model = storage.get_by_uuid(UUID, item_type='snowball')
+    assert model.item_type == 'lab'
+    assert es.calls == [('get', 'snowball'), ('search', '_all')]
+    assert storage.get_by_uuid('00000000-0000-0000-0000-000000000000') is None
+
+
+class FakeRequest(object):
+    def __init__(self, edits):
+        self.session = {'edits': edits}
+
+
+def test_session_edits_since():
+    from snovault.elasticsearch.esstorage import session_edits
+    request = FakeRequest([[10, ['a'], []], [20, ['b'], ['c']]])
+    edits = session_edits(request)
+    assert session_edits(request) is edits
+    assert edits.since(21) is None
+    assert edits.since(5) == ({'a', 'b'}, {'c'})
+    assert edits.since(15) == ({'b'}, {'c'})
+    request.session['edits'].append([30, ['d'], []])
+    assert session_edits(request) is not edits
+    assert session_edits(request).since(25) == ({'d'}, set())
+    assert session_edits(FakeRequest([])) is None
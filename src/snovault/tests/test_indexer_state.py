@@ -0,0 +1,86 @@
+""" IndexerState list storage, using the sql backend so that no
+elasticsearch is required.
+"""
+import pytest
+import uuid
+
+
+@pytest.fixture
+def backend():
+    from sqlalchemy import create_engine
+    from snovault.elasticsearch.state_storage import SQLStateBackend
+    from snovault.storage import IndexerStateDocument
+    engine = create_engine('sqlite://')
+    IndexerStateDocument.__table__.create(engine)
+    return SQLStateBackend(engine)
+
+
+@pytest.fixture
+def state(backend):
+    from snovault.elasticsearch.indexer_state import IndexerState
+    return IndexerState(None, 'snovault', followups=['vis_indexer'], backend=backend)
+
+
+def test_encode_uuids():
+    from snovault.elasticsearch.state_storage import decode_uuids, encode_uuids
+    uuids = [str(uuid.uuid4()) for i in range(1000)]
+    assert decode_uuids(encode_uuids(uuids + uuids[:10])) == sorted(uuids)
+    assert decode_uuids(encode_uuids([])) == []
+
+
+def test_encode_chunks_keeps_markers():
+    from snovault.elasticsearch.state_storage import decode_chunk, encode_chunks
+    first = sorted(str(uuid.uuid4()) for i in range(5))
+    second = sorted(str(uuid.uuid4()) for i in range(5))
+    values = ['xmin:1'] + first + ['xmin:2'] + second
+    chunks = list(encode_chunks(values, chunk_uuids=3))
+    assert [chunk['count'] for chunk in chunks] == [4, 2, 4, 2]
+    decoded = []
+    for chunk in chunks:
+        decoded.extend(decode_chunk(chunk))
+    assert decoded == values
+
+
+def test_list_extend_appends_chunks(state, backend):
+    uuids = sorted(str(uuid.uuid4()) for i in range(10))
+    state.put_list('staged', ['xmin:1'] + uuids[:5])
+    state.list_extend('staged', ['xmin:2'] + uuids[5:])
+    assert state.get_count('staged') == 12
+    assert backend.get('staged') == {'chunks': 2, 'count': 12}
+    assert state.get_list('staged') == ['xmin:1'] + uuids[:5] + ['xmin:2'] + uuids[5:]
+    state.delete_objs(['staged'])
+    assert backend.mget(['staged', 'staged.0', 'staged.1']) == [{}, {}, {}]
+
+
+def test_old_list_format(state, backend):
+    backend.put('registered_indexers', {'list': ['primary_indexer'], 'count': 1})
+    state.set_add('registered_indexers', ['vis_indexer'])
+    assert sorted(state.get_list('registered_indexers')) == ['primary_indexer', 'vis_indexer']
+
+
+def test_cycle_checkpoint_and_followup(state):
+    from snovault.elasticsearch.indexer_state import IndexerState
+    uuids = [str(uuid.uuid4()) for i in range(20)]
+    state.prep_for_followup(5, uuids)
+    state.start_cycle(uuids, {})
+    state.checkpoint(uuids[:8])
+    restarted = IndexerState(None, 'snovault', backend=state.backend)
+    assert restarted.get_undone() == sorted(uuids[8:])
+    result = state.finish_cycle({'cycle_count': 20}, [])
+    assert result['indexed'] == 20
+    assert state.get_list(state.last_set) == sorted(uuids)
+    assert state.get_list('staged_for_vis_indexer') == ['xmin:5'] + sorted(uuids)
+
+
+def test_update_objects_invalidates_cycle_once(mocker):
+    from snovault.elasticsearch.indexer import Indexer
+    indexer = Indexer.__new__(Indexer)
+    indexer.chunk_size = 2
+    invalidate = mocker.patch.object(Indexer, 'invalidate_embeds')
+    update_chunk = mocker.patch.object(Indexer, 'update_chunk', return_value=[])
+    uuids = [str(uuid.uuid4()) for i in range(5)]
+    checkpoints = []
+    indexer.update_objects(None, uuids, 1, checkpoint=checkpoints.append)
+    invalidate.assert_called_once_with(None, uuids)
+    assert update_chunk.call_count == 3
+    assert checkpoints == [uuids[:2], uuids[2:4], uuids[4:]]
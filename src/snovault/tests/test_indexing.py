@@ -116,6 +116,171 @@ def test_indexer_state(dummy_request):
     assert result['status'] == 'done'
 
 
+def test_indexer_state_checkpoint(dummy_request):
+    import uuid
+    from snovault.elasticsearch.indexer_state import IndexerState
+    INDEX = dummy_request.registry.settings['snovault.elasticsearch.index']
+    es = dummy_request.registry['elasticsearch']
+    state = IndexerState(es, INDEX)
+    uuids = [str(uuid.uuid4()) for i in range(20)]
+    state.start_cycle(uuids, state.get_initial_state())
+    assert state.todo_uuids == sorted(uuids)
+    assert sorted(state.get_list(state.todo_set)) == sorted(uuids)
+    state.checkpoint(uuids[:5])
+    state.checkpoint(uuids[3:8] + ['not-in-cycle'])
+    es.indices.refresh(index=INDEX)
+    restarted = IndexerState(es, INDEX)
+    assert restarted.get_undone() == sorted(uuids[8:])
+    assert restarted.done_count == 8
+    state.finish_cycle(state.get(), [])
+
+
+def test_indexer_flush_bulk_item_results(registry, mocker):
+    from snovault.elasticsearch import indexer as indexer_module
+    from snovault.elasticsearch.indexer import Indexer
+    results = [
+        (True, {'index': {'_id': 'a', 'status': 201}}),
+        (False, {'index': {'_id': 'b', 'status': 409, 'error': 'version_conflict_engine_exception'}}),
+        (False, {'index': {'_id': 'c', 'status': 400, 'error': 'mapper_parsing_exception'}}),
+    ]
+    streaming_bulk = mocker.patch.object(indexer_module, 'streaming_bulk', return_value=iter(results))
+    indexer = Indexer(registry)
+    docs = [{'uuid': uuid, 'item_type': 'testing_post_put_patch'} for uuid in 'abc']
+    errors = indexer.flush_bulk(docs, 1)
+    assert streaming_bulk.call_count == 1
+    actions = streaming_bulk.call_args[0][1]
+    assert {action['_version_type'] for action in actions} == {'external_gte'}
+    assert [error['uuid'] for error in errors] == ['c']
+
+
+def test_dependency_graph(registry, session):
+    import uuid
+    from snovault.elasticsearch.dependency_graph import DependencyGraph
+    a, b, c = (str(uuid.uuid4()) for i in range(3))
+    # Write through the test transaction so the rows are rolled back.
+    graph = DependencyGraph(registry, batchsize=1, bind=session.connection())
+    graph.update([(a, [a, b], [a, b, c]), (b, [b], [b])])
+    assert graph.dependents([b], []) == {a, b}
+    assert graph.dependents([], [c]) == {a}
+    graph.update([(a, [a], [a])])
+    assert graph.dependents([b], [c]) == {b}
+
+
+def test_get_related_uuids_with_graph(dummy_request):
+    from snovault.elasticsearch.indexer import get_related_uuids
+
+    class Graph(object):
+        def dependents(self, updated, renamed):
+            return {'x'}
+
+    updated = {str(i) for i in range(10000)}
+    assert get_related_uuids(dummy_request, None, updated, set(), Graph()) == {'x'}
+    assert get_related_uuids(dummy_request, None, set(), set(), Graph()) == set()
+
+
+def test_get_related_uuids_slices(dummy_request, mocker):
+    from snovault.elasticsearch import indexer as indexer_module
+    from snovault.elasticsearch.indexer import get_related_uuids
+
+    def scan(es, query, **kw):
+        terms = query['query']['terms']
+        field = 'embedded_uuids' if 'embedded_uuids' in terms else 'linked_uuids'
+        return iter({'_id': '%s-%s' % (field, value)} for value in terms[field])
+
+    scan = mocker.patch.object(indexer_module, 'scan', side_effect=scan)
+    es = mocker.Mock()
+    dummy_request.registry.settings['indexer.related_slice_size'] = 10
+    try:
+        updated = {str(i) for i in range(25)}
+        related = get_related_uuids(dummy_request, es, updated, {'r'})
+    finally:
+        del dummy_request.registry.settings['indexer.related_slice_size']
+    assert scan.call_count == 4
+    assert related == {'embedded_uuids-%s' % uuid for uuid in updated} | {'linked_uuids-r'}
+
+
+def test_scan_transactions(testapp, DBSession):
+    from snovault.elasticsearch.indexer import scan_transactions
+    res = testapp.post_json('/testing-post-put-patch/', {'required': ''})
+    uuid = res.json['@graph'][0]['uuid']
+    updated, renamed, txn_count, max_xid, first_txn = scan_transactions(DBSession(), 0)
+    assert uuid in updated
+    assert txn_count >= 1
+    assert first_txn is not None
+
+
+def test_indexer_skip_unchanged(registry, mocker):
+    from snovault.elasticsearch.indexer import Indexer
+    indexer = Indexer(registry)
+    indexer.skip_unchanged = True
+    docs = [{'uuid': uuid, 'item_type': 'testing_post_put_patch', 'n': 1} for uuid in 'abc']
+    for doc in docs:
+        doc['index_hash'] = indexer.index_hash(doc)
+    assert indexer.index_hash(docs[0]) == docs[0]['index_hash']
+    indexer.es = mocker.Mock()
+    indexer.es.mget.return_value = {'docs': [
+        {'_id': 'a', 'found': True, '_source': {'index_hash': docs[0]['index_hash']}},
+        {'_id': 'b', 'found': True, '_source': {'index_hash': 'stale'}},
+        {'_id': 'c', 'found': False},
+    ]}
+    stats = {}
+    changed = indexer.skip_unchanged_docs(docs, stats)
+    assert [doc['uuid'] for doc in changed] == ['b', 'c']
+    assert stats == {'skipped': 1}
+
+
+def test_mpindexer_pipelined(registry, mocker):
+    from snovault.elasticsearch.mpindexer import MPIndexer
+
+    class Result(object):
+        def ready(self):
+            return True
+
+    class Pool(object):
+        def apply_async(self, func, args, callback, error_callback):
+            uuids = args[0][0]
+            docs = [{'uuid': uuid} for uuid in uuids if uuid != 'bad']
+            errors = [{'uuid': uuid} for uuid in uuids if uuid == 'bad']
+            callback((docs, errors, 1.0))
+            return Result()
+
+    indexer = MPIndexer(registry, processes=1)
+    indexer.pool = Pool()
+    indexer.bulk_size = 2
+    flush_bulk = mocker.patch.object(indexer, 'flush_bulk', return_value=[])
+    tasks = [(['a', 'b', 'c'], 1, None, False, None), (['bad', 'd'], 1, None, False, None)]
+    stats = {}
+    errors = indexer.update_objects_pipelined(tasks, 1, stats)
+    assert errors == [{'uuid': 'bad'}]
+    assert flush_bulk.call_count == 3
+    assert stats['chunks'] == 2
+    assert stats['render_time'] == 2.0
+    assert stats['max_queue_depth'] >= 1
+
+
+def test_mpindexer_pipelined_worker_died(registry, mocker):
+    from snovault.elasticsearch.mpindexer import MPIndexer
+
+    class Result(object):
+        def ready(self):
+            return False
+
+    class Pool(object):
+        def apply_async(self, func, args, callback, error_callback):
+            # A dead worker calls neither callback.
+            return Result()
+
+    indexer = MPIndexer(registry, processes=1)
+    indexer.pool = Pool()
+    indexer.pipeline_depth = 1
+    indexer.render_timeout = 0
+    flush_bulk = mocker.patch.object(indexer, 'flush_bulk', return_value=[])
+    tasks = [(['a'], 1, None, False, None), (['b'], 1, None, False, None)]
+    with pytest.raises(TimeoutError):
+        indexer.update_objects_pipelined(tasks, 1)
+    assert not flush_bulk.called
+
+
 def test_listening(testapp, listening_conn):
     import time
     testapp.post_json('/testing-post-put-patch/', {'required': ''})
@@ -76,3 +76,16 @@ def test_keys_conflict(testapp):
     assert(conflict.status_code == 409)
     conflicted = testapp.get(url).json['@graph']
     assert(len(posted) == len(conflicted))
+
+
+def test_connection_get_by_unique_keys(app, testapp, content):
+    from snovault import CONNECTION
+    conn = app.registry[CONNECTION]
+    found = conn.get_by_unique_keys([
+        ('testing_accession', 'TEST2'),
+        ('testing_accession', 'MISSING'),
+        ('testing_accession', 'TEST1'),
+    ])
+    assert [item and item.properties['name'] for item in found] == ['two', None, 'one']
+    uuids = [str(found[0].uuid), 'not-a-uuid', str(found[2].uuid)]
+    assert conn.get_by_uuids(uuids) == [found[0], None, found[2]]
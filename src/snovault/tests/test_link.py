@@ -85,3 +85,45 @@ def test_links_quoted_ids(content, testapp, session):
     target = res.json
     source = {'name': 'C', 'target': target['@id']}
     testapp.post_json('/testing-link-sources/', source, status=201)
+
+
+def test_links_storage_targets(content, storage):
+    targets_found = storage.get_link_targets([source['uuid'] for source in sources])
+    assert {str(rid) for rid in targets_found} == {targets[0]['uuid'], targets[1]['uuid']}
+
+
+def test_links_prefetch(content, connection, threadlocals):
+    connection.prefetch([sources[0]['uuid']])
+    assert sources[0]['uuid'] in connection.item_cache
+    assert targets[0]['uuid'] in connection.item_cache
+    assert targets[1]['uuid'] not in connection.item_cache
+
+
+def test_collect_links():
+    from snovault.schema_utils import collect_links
+    schema = {
+        'properties': {
+            'target': {'type': 'string', 'linkTo': 'TestingLinkTarget'},
+            'targets': {'type': 'array', 'items': {'type': 'string', 'linkTo': ['A', 'B']}},
+            'name': {'type': 'string'},
+        },
+    }
+    links = []
+    collect_links(schema, {'target': 'one', 'targets': ['two', 'three'], 'name': 'A'}, links)
+    assert sorted(links, key=lambda link: link[1]) == [
+        ('TestingLinkTarget', 'one'),
+        (['A', 'B'], 'three'),
+        (['A', 'B'], 'two'),
+    ]
+
+
+def test_bulk_post_resolves_links(content, testapp):
+    items = [
+        {'target': 'one'},
+        {'target': '/testing-link-targets/quote:name/'},
+        {'target': targets[1]['uuid']},
+        {'target': 'missing'},
+    ]
+    res = testapp.post_json('/testing-link-sources/@@bulk', items, status=200)
+    statuses = [result['status'] for result in res.json['@graph']]
+    assert statuses == ['success', 'success', 'success', 'error']
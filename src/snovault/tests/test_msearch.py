@@ -0,0 +1,48 @@
+import pytest
+
+
+class FakeES(object):
+    def __init__(self):
+        self.calls = []
+
+    def search(self, index, body):
+        self.calls.append(('search', index, body))
+        return {'hits': {'total': 1}}
+
+    def msearch(self, body):
+        self.calls.append(('msearch', body))
+        responses = []
+        for header, query in zip(body[::2], body[1::2]):
+            if query.get('size') == -1:
+                responses.append({'error': {'type': 'illegal_argument_exception'}, 'status': 400})
+            else:
+                responses.append({'hits': {'total': query.get('size')}})
+        return {'responses': responses}
+
+
+def test_msearch_single_search():
+    from snovault.elasticsearch.msearch import MultiSearch
+    es = FakeES()
+    searches = MultiSearch(es)
+    result = searches.add({'query': {}}, ['snowball', 'snowflake'], from_=5, size=10).result()
+    assert result == {'hits': {'total': 1}}
+    assert es.calls == [
+        ('search', 'snowball,snowflake', {'query': {}, 'from': 5, 'size': 10}),
+    ]
+
+
+def test_msearch_batches_pending_searches():
+    from elasticsearch.exceptions import TransportError
+    from snovault.elasticsearch.msearch import MultiSearch
+    es = FakeES()
+    searches = MultiSearch(es)
+    first = searches.add({'query': {}}, 'snowball', size=1)
+    second = searches.add({'query': {}}, 'snowflake', size=2)
+    failed = searches.add({'query': {}}, 'snowflake', size=-1)
+    assert second.result() == {'hits': {'total': 2}}
+    assert first.result() == {'hits': {'total': 1}}
+    with pytest.raises(TransportError):
+        failed.result()
+    assert len(es.calls) == 1
+    assert es.calls[0][1][::2] == [{'index': 'snowball'}, {'index': 'snowflake'}, {'index': 'snowflake'}]
+    assert not searches.pending
@@ -220,3 +220,32 @@ def test_retry(testapp):
     res = testapp.get(url + '/@@testing-retry?datstore=database')
     assert res.json['attempt'] == 2
     assert not res.json['detached']
+
+
+def test_bulk_post(testapp, link_targets):
+    items = [
+        {'name': 'three'},
+        {'name': 'one'},
+        {'name': 'four', 'uuid': targets[1]['uuid']},
+        {'name': 'five', 'unknown': 'property'},
+        {'name': 'three'},
+    ]
+    res = testapp.post_json('/testing-link-targets/@@bulk', items, status=200)
+    statuses = [result['status'] for result in res.json['@graph']]
+    assert statuses == ['success', 'error', 'error', 'error', 'error']
+    assert res.json['created'] == 1
+    testapp.get('/testing-link-targets/three/', status=200)
+
+
+def test_bulk_post_ndjson(testapp, link_targets):
+    body = b'\n'.join([
+        b'{"target": "one"}',
+        b'{"target": "two", "status": "released"}',
+        b'not json',
+    ])
+    res = testapp.post('/testing-link-sources/@@bulk', body,
+                       content_type='application/x-ndjson', status=200)
+    results = res.json['@graph']
+    assert [result['status'] for result in results] == ['success', 'success', 'error']
+    res = testapp.get('/%s/' % results[1]['uuid'])
+    assert res.json['target'] == '/testing-link-targets/two/'
@@ -189,6 +189,79 @@ def test_delete_compound(session, storage):
     assert session.query(CurrentPropertySheet).count() == 0
 
 
+def test_get_by_uuids(session, storage):
+    import uuid
+    from snovault.storage import Resource
+    resources = [Resource('test_item', {'': {'n': n}}) for n in range(3)]
+    for resource in resources:
+        session.add(resource)
+    session.flush()
+    rids = [str(resource.rid) for resource in resources[:2]]
+    models = storage.get_by_uuids(rids + [str(uuid.uuid4())])
+    assert sorted(str(model.rid) for model in models) == sorted(rids)
+    assert sorted(model.properties['n'] for model in models) == [0, 1]
+
+
+def test_get_by_unique_keys(session, storage):
+    from snovault.storage import (
+        Key,
+        Resource,
+    )
+    resources = [Resource('test_item', {'': {'n': n}}) for n in range(2)]
+    for resource in resources:
+        session.add(resource)
+    session.flush()
+    for n, resource in enumerate(resources):
+        session.add(Key(rid=resource.rid, name='test:name', value='name%d' % n))
+    session.add(Key(rid=resources[0].rid, name='test:alias', value='alias0'))
+    session.flush()
+    found = storage.get_by_unique_keys([
+        ('test:name', 'name0'),
+        ('test:name', 'name1'),
+        ('test:alias', 'alias0'),
+        ('test:name', 'missing'),
+    ])
+    assert {pair: model.rid for pair, model in found.items()} == {
+        ('test:name', 'name0'): resources[0].rid,
+        ('test:name', 'name1'): resources[1].rid,
+        ('test:alias', 'alias0'): resources[0].rid,
+    }
+
+
+def test_update_links_and_keys_diff(session, storage):
+    from snovault.storage import (
+        Key,
+        Link,
+        Resource,
+    )
+    targets = [Resource('test_item', {'': {'n': n}}) for n in range(3)]
+    for target in targets:
+        session.add(target)
+    session.flush()
+    target_ids = [str(target.rid) for target in targets]
+
+    resource = Resource('test_item')
+    storage.update(
+        resource, {'name': 'one'},
+        unique_keys={'test:name': ['one', 'uno']},
+        links={'parts': target_ids[:2]},
+    )
+    assert {(link.rel, str(link.target_rid)) for link in resource.rels} == {
+        ('parts', target_ids[0]), ('parts', target_ids[1])}
+    assert {key.value for key in resource.unique_keys} == {'one', 'uno'}
+
+    storage.update(
+        resource, {'name': 'two'},
+        unique_keys={'test:name': ['two', 'uno']},
+        links={'parts': target_ids[1:]},
+    )
+    links = session.query(Link).filter(Link.source_rid == resource.rid)
+    assert {str(link.target_rid) for link in links} == set(target_ids[1:])
+    assert {(key.name, key.value) for key in resource.unique_keys} == {
+        ('test:name', 'two'), ('test:name', 'uno')}
+    assert session.query(Key).get(('test:name', 'one')) is None
+
+
 def test_keys(session):
     from sqlalchemy.orm.exc import FlushError
     from snovault.storage import (
@@ -265,3 +338,28 @@ def test_S3BlobStorage_get_blob_url_for_non_s3_file(mocker):
     storage.read_conn.generate_url.assert_called_once_with(
         129600, method='GET', bucket='test', key=download_meta['blob_id']
     )
+
+
+def test_create_many_retries_conflicting_batch(session, storage):
+    from pyramid.httpexceptions import HTTPConflict
+    from snovault.storage import (
+        Key,
+        Resource,
+    )
+    existing = Resource('test_item', {'': {}})
+    session.add(existing)
+    session.flush()
+    session.add(Key(rid=existing.rid, name='test:name', value='taken'))
+    session.flush()
+
+    models = [Resource('test_item') for n in range(3)]
+    records = [
+        (model, {'name': name}, None, {'test:name': [name]}, {})
+        for model, name in zip(models, ['one', 'taken', 'three'])
+    ]
+    results = storage.create_many(records)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], HTTPConflict)
+    created = {key.value: key.rid for key in session.query(Key).filter(Key.name == 'test:name')}
+    assert created == {'one': models[0].rid, 'taken': existing.rid, 'three': models[2].rid}
+    assert session.query(Resource).get(models[0].rid).properties == {'name': 'one'}
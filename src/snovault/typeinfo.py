@@ -5,7 +5,10 @@ from .interfaces import (
     CALCULATED_PROPERTIES,
     TYPES,
 )
-from .schema_utils import combine_schemas
+from .schema_utils import (
+    CachedSchemaValidator,
+    combine_schemas,
+)
 
 
 def includeme(config):
@@ -45,6 +48,15 @@ class AbstractTypeInfo(object):
         subschemas = (self.types[name].schema for name in self.subtypes)
         return reduce(combine_schemas, subschemas)
 
+    @property
+    def schema_validator(self):
+        """ Validator for the schema, rebuilt only if the schema is replaced.
+        """
+        validator = self.__dict__.get('_schema_validator')
+        if validator is None or validator.schema is not self.schema:
+            validator = self._schema_validator = CachedSchemaValidator(self.schema)
+        return validator
+
 
 class TypeInfo(AbstractTypeInfo):
     def __init__(self, registry, item_type, factory):
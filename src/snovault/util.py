@@ -1,5 +1,10 @@
 from past.builtins import basestring
 from pyramid.threadlocal import manager as threadlocal_manager
+from uuid import UUID
+from .interfaces import (
+    CONNECTION,
+    ROOT,
+)
 
 
 def includeme(config):
@@ -35,6 +40,36 @@ def simple_path_ids(obj, path):
             yield result
 
 
+def prefetch_paths(request, paths):
+    """ Load the items for uuids or /collection/name/ paths in batches.
+
+    Items are looked up by uuid and by the collection's unique key, so that
+    embedding them afterwards finds them in the item cache.
+    """
+    root = request.registry[ROOT]
+    uuids = []
+    pairs = []
+    for path in paths:
+        parts = path.strip('/').split('/')
+        name = parts[-1]
+        try:
+            UUID(name)
+        except ValueError:
+            if len(parts) != 2:
+                continue
+            collection = root.collections.get(parts[0])
+            unique_key = getattr(collection, 'unique_key', None)
+            if unique_key is not None:
+                pairs.append((unique_key, name))
+        else:
+            uuids.append(name)
+    conn = request.registry[CONNECTION]
+    if uuids:
+        conn.get_by_uuids(uuids)
+    if pairs:
+        conn.get_by_unique_keys(pairs)
+
+
 def expand_path(request, obj, path):
     if isinstance(path, basestring):
         path = path.split('.')
@@ -46,6 +81,9 @@ def expand_path(request, obj, path):
     if value is None:
         return
     if isinstance(value, list):
+        unexpanded = [member for member in value if not isinstance(member, dict)]
+        if len(unexpanded) > 1:
+            prefetch_paths(request, unexpanded)
         for index, member in enumerate(value):
             if not isinstance(member, dict):
                 member = value[index] = request.embed(member, '@@object')
@@ -62,6 +100,8 @@ def select_distinct_values(request, value_path, *from_paths):
 
     values = from_paths
     for name in value_path:
+        if len(values) > 1:
+            prefetch_paths(request, values)
         objs = (request.embed(member, '@@object') for member in values)
         value_lists = (ensurelist(obj.get(name, [])) for obj in objs)
         values = {value for value_list in value_lists for value in value_list}
@@ -35,7 +35,8 @@ def no_validate_item_content_patch(context, request):
 
 def validate_item_content_post(context, request):
     data = request.json
-    validate_request(context.type_info.schema, request, data)
+    type_info = context.type_info
+    validate_request(type_info.schema, request, data, validator=type_info.schema_validator)
 
 
 def validate_item_content_put(context, request):
@@ -44,9 +45,9 @@ def validate_item_content_put(context, request):
     if 'uuid' in data and UUID(data['uuid']) != context.uuid:
         msg = 'uuid may not be changed'
         raise ValidationFailure('body', ['uuid'], msg)
-    current = context.upgrade_properties().copy()
+    current = context.upgrade_properties(copy=False).copy()
     current['uuid'] = str(context.uuid)
-    validate_request(schema, request, data, current)
+    validate_request(schema, request, data, current, context.type_info.schema_validator)
 
 
 def validate_item_content_patch(context, request):
@@ -58,6 +59,6 @@ def validate_item_content_patch(context, request):
     if 'uuid' in data and UUID(data['uuid']) != context.uuid:
         msg = 'uuid may not be changed'
         raise ValidationFailure('body', ['uuid'], msg)
-    current = context.upgrade_properties().copy()
+    current = context.upgrade_properties(copy=False).copy()
     current['uuid'] = str(context.uuid)
-    validate_request(schema, request, data, current)
+    validate_request(schema, request, data, current, context.type_info.schema_validator)
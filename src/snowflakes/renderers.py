@@ -77,6 +77,15 @@ def fix_request_method_tween_factory(handler, registry):
     return fix_request_method_tween
 
 
+def is_ndjson_bulk(request):
+    """ The @@bulk view also accepts newline delimited JSON.
+    """
+    if request.content_type != 'application/x-ndjson':
+        return False
+    path = split_path_info(request.path_info)
+    return bool(path) and path[-1] in ('@@bulk', 'bulk')
+
+
 def security_tween_factory(handler, registry):
 
     def security_tween(request):
@@ -98,7 +107,7 @@ def security_tween_factory(handler, registry):
         if request.method in ('GET', 'HEAD'):
             return handler(request)
 
-        if request.content_type != 'application/json':
+        if request.content_type != 'application/json' and not is_ndjson_bulk(request):
             detail = "%s is not 'application/json'" % request.content_type
             raise HTTPUnsupportedMediaType(detail)
 
@@ -4,17 +4,32 @@ from snovault import (
     AbstractCollection,
     TYPES,
 )
-from snovault.elasticsearch import ELASTIC_SEARCH
+from snovault.elasticsearch import (
+    ELASTIC_SEARCH,
+    SEARCH_CACHE,
+)
+from snovault.elasticsearch.msearch import request_searches
+from snovault.cache import SizedLRUCache
 from snovault.resource_views import collection_view_listing_db
-from elasticsearch.helpers import scan
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.security import effective_principals
 from urllib.parse import urlencode
 from collections import OrderedDict
+from functools import lru_cache
+import threading
 
 
 CHAR_COUNT = 32
 
+# Translated search terms kept in memory
+SEARCH_TERM_CACHE_SIZE = 1000
+
+# Registry key of the default columns by doc_types
+DEFAULT_COLUMNS = 'search_default_columns'
+
+# Hits fetched per request when streaming large result sets
+SEARCH_AFTER_PAGE_SIZE = 1000
+
 
 def includeme(config):
     config.add_route('search', '/search{slash:/?}')
@@ -22,6 +37,9 @@ def includeme(config):
     config.scan(__name__)
 
 
+plain_word_re = re.compile(r'^[A-Za-z0-9]+$')
+query_operators = {'and', 'or', 'not', 'to'}
+
 sanitize_search_string_re = re.compile(r'[\\\+\-\&\|\!\(\)\{\}\[\]\^\~\:\/\\\*\?]')
 
 audit_facets = [
@@ -32,6 +50,13 @@ audit_facets = [
 ]
 
 
+# Aggregation applying the filters shared by all facets
+FACETS_AGGREGATION = 'facets'
+
+# Query parameters which do not change facet counts
+FACET_INDEPENDENT_PARAMS = ('from', 'limit', 'sort', 'frame', 'field', 'format')
+
+
 DEFAULT_DOC_TYPES = [
     'Lab',
     'Snowset',
@@ -85,15 +110,22 @@ def get_filtered_query(term, search_fields, result_fields, principals, doc_types
     }
 
 
-def prepare_search_term(request):
+@lru_cache(maxsize=SEARCH_TERM_CACHE_SIZE)
+def translate_search_term(search_term):
+    """
+    Returns the elasticsearch query string for search_term, or None if it
+    cannot be parsed.
+    """
+    # Plain words need no rewriting, so skip the parser.
+    words = search_term.split()
+    if all(plain_word_re.match(word) and word.lower() not in query_operators for word in words):
+        return search_term
+
+    # antlr is slow to import, so only load it once a query needs parsing
     from antlr4 import IllegalStateException
     from lucenequery.prefixfields import prefixfields
     from lucenequery import dialects
 
-    search_term = request.params.get('searchTerm', '').strip() or '*'
-    if search_term == '*':
-        return search_term
-
     # avoid interpreting slashes as regular expressions
     search_term = search_term.replace('/', r'\/')
     # elasticsearch uses : as field delimiter, but we use it as namespace designator
@@ -105,12 +137,23 @@ def prepare_search_term(request):
     try:
         query = prefixfields('embedded.', search_term, dialects.elasticsearch)
     except (IllegalStateException):
-        msg = "Invalid query: {}".format(search_term)
-        raise HTTPBadRequest(explanation=msg)
+        return None
     else:
         return query.getText()
 
 
+def prepare_search_term(request):
+    search_term = request.params.get('searchTerm', '').strip() or '*'
+    if search_term == '*':
+        return search_term
+
+    query = translate_search_term(search_term)
+    if query is None:
+        msg = "Invalid query: {}".format(search_term)
+        raise HTTPBadRequest(explanation=msg)
+    return query
+
+
 def set_sort_order(request, search_term, types, doc_types, query, result):
     """
     sets sort order for elasticsearch results
@@ -164,6 +207,39 @@ def set_sort_order(request, search_term, types, doc_types, query, result):
     return False
 
 
+def search_after_sort(query):
+    """
+    Returns the query sort as a list ending with a unique tiebreaker,
+    as needed to page through results with search_after
+    """
+    sort = [{field: options} for field, options in query.get('sort', {}).items()]
+    if not sort:
+        sort.append('_doc')
+    sort.append({'_uid': 'asc'})
+    return sort
+
+
+def iter_search_after(es, query, index, page, size=None, page_size=SEARCH_AFTER_PAGE_SIZE):
+    """
+    Yields the hits of page and then of the following pages, requested with
+    the sort values of the previous page's last hit, until size hits have
+    been returned. Only one page is held in memory at a time.
+    """
+    query = dict(query)
+    count = 0
+    while True:
+        hits = page['hits']['hits']
+        for hit in hits:
+            if size is not None and count >= size:
+                return
+            yield hit
+            count += 1
+        if len(hits) < page_size or (size is not None and count >= size):
+            return
+        query['search_after'] = hits[-1]['sort']
+        page = es.search(body=query, index=index, size=page_size)
+
+
 def get_search_fields(request, doc_types):
     """
     Returns set of columns that are being searched and highlights
@@ -179,7 +255,7 @@ def get_search_fields(request, doc_types):
     return list(fields), highlights
 
 
-def list_visible_columns_for_schemas(request, schemas):
+def default_columns_for_schemas(schemas):
     """
     Returns mapping of default columns for a set of schemas.
     """
@@ -198,7 +274,27 @@ def list_visible_columns_for_schemas(request, schemas):
                     'aliases'
                 ] if name in schema['properties']
             ))
+    return columns
+
+
+def default_columns(registry, doc_types):
+    """
+    Returns default columns for doc_types, computed once per set of types.
+    """
+    cache = registry.setdefault(DEFAULT_COLUMNS, {})
+    key = tuple(doc_types)
+    columns = cache.get(key)
+    if columns is None:
+        types = registry[TYPES]
+        schemas = [types[doc_type].schema for doc_type in doc_types]
+        columns = cache[key] = default_columns_for_schemas(schemas)
+    return OrderedDict(columns)
 
+
+def limit_columns(request, columns, schemas):
+    """
+    Limits columns to the field= parameters, if any.
+    """
     fields_requested = request.params.getall('field')
     if fields_requested:
         limited_columns = OrderedDict()
@@ -221,6 +317,22 @@ def list_visible_columns_for_schemas(request, schemas):
     return columns
 
 
+def list_visible_columns_for_schemas(request, schemas):
+    """
+    Returns mapping of visible columns for a set of schemas.
+    """
+    return limit_columns(request, default_columns_for_schemas(schemas), schemas)
+
+
+def list_visible_columns(request, doc_types):
+    """
+    Returns mapping of visible columns for doc_types.
+    """
+    types = request.registry[TYPES]
+    schemas = [types[doc_type].schema for doc_type in doc_types]
+    return limit_columns(request, default_columns(request.registry, doc_types), schemas)
+
+
 def list_result_fields(request, doc_types):
     """
     Returns set of fields that are requested by user or default fields
@@ -231,15 +343,13 @@ def list_result_fields(request, doc_types):
         fields = {'embedded.@id', 'embedded.@type'}
         fields.update('embedded.' + field for field in fields_requested)
     elif frame in ['embedded', 'object']:
-        fields = [frame + '.*']
+        fields = {frame + '.*'}
     else:
         frame = 'columns'
         fields = {'embedded.@id', 'embedded.@type'}
         if request.has_permission('search_audit'):
             fields.add('audit.*')
-        types = request.registry[TYPES]
-        schemas = [types[doc_type].schema for doc_type in doc_types]
-        columns = list_visible_columns_for_schemas(request, schemas)
+        columns = default_columns(request.registry, doc_types)
         fields.update('embedded.' + column for column in columns)
 
     # Ensure that 'audit' field is requested with _source in the ES query
@@ -397,59 +507,106 @@ def build_aggregation(facet_name, facet_options, min_doc_count=0):
     return agg_name, agg
 
 
-def set_facets(facets, used_filters, principals, doc_types):
+def facet_filter(field, terms):
     """
-    Sets facets in the query using filters
+    Returns ('must' or 'must_not', clause) for a used filter
     """
-    aggs = {}
+    query_field = field[:-1] if field.endswith('!') else field
+    if not query_field.startswith('audit'):
+        query_field = 'embedded.' + query_field
+    if terms == ['*']:
+        clause = {'exists': {'field': query_field}}
+    else:
+        clause = {'terms': {query_field: terms}}
+    return ('must_not' if field.endswith('!') else 'must'), clause
+
+
+def facet_filters(fields, used_filters, filters=None):
+    """
+    Builds a bool filter from the used filters on fields
+    """
+    query_filters = {'must': filters or [], 'must_not': []}
+    for field in fields:
+        occur, clause = facet_filter(field, used_filters[field])
+        query_filters[occur].append(clause)
+    return {'bool': query_filters}
+
+
+def plan_facets(facets, filter_fields):
+    """
+    Compiles facets for a set of used filter fields.
+
+    A filter on a field applies to every facet but the facet for that field,
+    so filters on fields without a facet are shared by all facets. Returns
+    (shared_fields, [(agg_name, agg, facet_fields)]).
+    """
+    facet_names = {facet_name for facet_name, facet_options in facets}
+    shared_fields = [field for field in filter_fields if field.rstrip('!') not in facet_names]
+    compiled = []
     for facet_name, facet_options in facets:
-        # Filter facet results to only include
-        # objects of the specified type(s) that the user can see
-        filters = [
-            {'terms': {'principals_allowed.view': principals}},
-            {'terms': {'embedded.@type': doc_types}},
+        agg_name, agg = build_aggregation(facet_name, facet_options)
+        # if an option was selected in this facet,
+        # don't filter the facet to only include that option
+        facet_fields = [
+            field for field in filter_fields
+            if field not in shared_fields and field.rstrip('!') != facet_name
         ]
-        negative_filters = []
-        # Also apply any filters NOT from the same field as the facet
-        for field, terms in used_filters.items():
-            if field.endswith('!'):
-                query_field = field[:-1]
-            else:
-                query_field = field
+        compiled.append((agg_name, agg, facet_fields))
+    return shared_fields, compiled
 
-            # if an option was selected in this facet,
-            # don't filter the facet to only include that option
-            if query_field == facet_name:
-                continue
 
-            if not query_field.startswith('audit'):
-                query_field = 'embedded.' + query_field
+# Compiled facets keyed by (doc_types, facet names, used filter fields)
+_facet_plans = SizedLRUCache(max_entries=1000, sizeof=lambda plan: 0)
+_facet_plans_lock = threading.Lock()
 
-            if field.endswith('!'):
-                if terms == ['*']:
-                    negative_filters.append({'exists': {'field': query_field}})
-                else:
-                    negative_filters.append({'terms': {query_field: terms}})
-            else:
-                if terms == ['*']:
-                    filters.append({'exists': {'field': query_field}})
-                else:
-                    filters.append({'terms': {query_field: terms}})
 
-        agg_name, agg = build_aggregation(facet_name, facet_options)
-        aggs[agg_name] = {
-            'aggs': {
-                agg_name: agg
-            },
-            'filter': {
-                'bool': {
-                    'must': filters,
-                    'must_not': negative_filters
+def set_facets(facets, used_filters, principals, doc_types):
+    """
+    Sets facets in the query using filters
+
+    The principals, type and any filters common to every facet are applied
+    once by the FACETS_AGGREGATION filter aggregation, with each facet as a
+    sub-aggregation filtered only by the remaining used filters.
+    """
+    filter_fields = tuple(sorted(used_filters))
+    key = (tuple(doc_types), tuple(facet_name for facet_name, facet_options in facets), filter_fields)
+    with _facet_plans_lock:
+        plan = _facet_plans.get(key)
+    if plan is None:
+        plan = plan_facets(facets, filter_fields)
+        with _facet_plans_lock:
+            _facet_plans[key] = plan
+    shared_fields, compiled = plan
+
+    # Filter facet results to only include
+    # objects of the specified type(s) that the user can see
+    filters = [
+        {'terms': {'principals_allowed.view': principals}},
+        {'terms': {'embedded.@type': doc_types}},
+    ]
+    aggs = {}
+    for agg_name, agg, facet_fields in compiled:
+        if facet_fields:
+            aggs[agg_name] = {
+                'aggs': {
+                    agg_name: agg
                 },
-            },
-        }
+                'filter': facet_filters(facet_fields, used_filters),
+            }
+        else:
+            aggs[agg_name] = {
+                'aggs': {
+                    agg_name: agg
+                },
+                'filter': {'match_all': {}},
+            }
 
-    return aggs
+    return {
+        FACETS_AGGREGATION: {
+            'aggs': aggs,
+            'filter': facet_filters(shared_fields, used_filters, filters),
+        },
+    }
 
 
 def format_results(request, hits, result=None):
@@ -503,6 +660,8 @@ def format_facets(es_results, facets, used_filters, schemas, total, principals):
         return result
 
     aggregations = es_results['aggregations']
+    # Facets are nested within the shared filter aggregation from set_facets
+    aggregations = aggregations.get(FACETS_AGGREGATION, aggregations)
     used_facets = set()
     exists_facets = set()
     for field, options in facets:
@@ -550,11 +709,11 @@ def format_facets(es_results, facets, used_filters, schemas, total, principals):
     return result
 
 
-def normalize_query(request):
+def normalize_query(request, exclude=()):
     types = request.registry[TYPES]
     fixed_types = (
         (k, types[v].name if k == 'type' and v in types else v)
-        for k, v in request.params.items()
+        for k, v in request.params.items() if k not in exclude
     )
     qs = urlencode([
         (k.encode('utf-8'), v.encode('utf-8'))
@@ -609,6 +768,20 @@ def search(context, request, search_type=None, return_generator=False):
     es_index = '_all'
     search_audit = request.has_permission('search_audit')
 
+    # Cached results are only valid until the next indexing cycle finishes.
+    search_cache = request.registry.get(SEARCH_CACHE)
+    cache_key = facets_key = None
+    if search_cache is not None and not return_generator:
+        principals_key = tuple(sorted(principals))
+        cache_key = search_cache.key('search', request.path, search_type, principals_key, search_base)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        # Facets can be shared by requests for different pages of the same query.
+        facets_key = search_cache.key(
+            'facets', search_type, principals_key,
+            normalize_query(request, exclude=FACET_INDEPENDENT_PARAMS))
+
 
     # extract from/size from query parameters
     from_, size = get_pagination(request)
@@ -690,8 +863,7 @@ def search(context, request, search_type=None, return_generator=False):
                                doc_types)
 
     #  Columns is used in report view
-    schemas = [types[doc_type].schema for doc_type in doc_types]
-    columns = list_visible_columns_for_schemas(request, schemas)
+    columns = list_visible_columns(request, doc_types)
     # and here it is attached to the result for the UI
     if columns:
         result['columns'] = columns
@@ -726,7 +898,7 @@ def search(context, request, search_type=None, return_generator=False):
 
     query['aggs'] = set_facets(facets, used_filters, principals, doc_types)
 
-    # Decide whether to use scan for results.
+    # Decide whether to stream results.
     do_scan = size is None or size > 1000
 
     # Send search request to proper indices
@@ -735,11 +907,34 @@ def search(context, request, search_type=None, return_generator=False):
     else:
         es_index = [types[type_name].item_type for type_name in doc_types if hasattr(types[type_name], 'item_type')]
     
+    # Searches queued by the embedding request are sent along with this one
+    searches = request_searches(request)
+
+    cached_aggregations = None
+    if facets_key is not None:
+        cached_aggregations = search_cache.get(facets_key, 'facet_hits')
+        if cached_aggregations is not None:
+            del query['aggs']
+
     # Execute the query
     if do_scan:
-        es_results = es.search(body=query, index=es_index, search_type='query_then_fetch')
+        # Stream hits in sort order, without aggregations.
+        hits_query = dict(query, sort=search_after_sort(query))
+        hits_query.pop('aggs', None)
+        page_size = SEARCH_AFTER_PAGE_SIZE if size is None else min(size, SEARCH_AFTER_PAGE_SIZE)
+        # Facets are counted in the same _msearch as the first page of hits
+        facets_search = None
+        if 'aggs' in query:
+            facets_search = searches.add(query, es_index, size=0)
+        first_page = searches.add(hits_query, es_index, from_=from_, size=page_size).result()
+        es_results = first_page if facets_search is None else facets_search.result()
     else:
-        es_results = es.search(body=query, index=es_index, from_=from_, size=size)
+        es_results = searches.add(query, es_index, from_=from_, size=size).result()
+
+    if cached_aggregations is not None:
+        es_results['aggregations'] = cached_aggregations
+    elif facets_key is not None and 'aggregations' in es_results:
+        search_cache.set(facets_key, es_results['aggregations'])
 
     result['total'] = total = es_results['hits']['total']
 
@@ -771,16 +966,12 @@ def search(context, request, search_type=None, return_generator=False):
             return graph
         else:
             result['@graph'] = list(graph)
+            if cache_key is not None:
+                search_cache.set(cache_key, result)
             return result
 
-    # Scan large result sets.
-    del query['aggs']
-    if size is None:
-        # preserve_order=True has unexpected results in clustered environment
-        # https://github.com/elastic/elasticsearch-py/blob/master/elasticsearch/helpers/__init__.py#L257
-        hits = scan(es, query=query, index=es_index, preserve_order=False)
-    else:
-        hits = scan(es, query=query, index=es_index, from_=from_, size=size, preserve_order=False)
+    # Page through large result sets.
+    hits = iter_search_after(es, hits_query, es_index, first_page, size, page_size)
     graph = format_results(request, hits, result)
 
     # Support for request.embed() and `return_generator`
@@ -59,3 +59,19 @@ def test_etag_if_match_tid(testapp, award):
     etag = res.etag
     testapp.patch_json(award['@id'], {}, headers={'If-Match': etag}, status=200)
     testapp.patch_json(award['@id'], {}, headers={'If-Match': etag}, status=412)
+
+
+def test_schema_validator_reused(registry):
+    from snovault import TYPES
+    from snovault.schema_utils import validate
+    type_info = registry[TYPES]['TestingDependencies']
+    validator = type_info.schema_validator
+    assert type_info.schema_validator is validator
+    validated, errors = validate(
+        type_info.schema, {'dep1': 'dep1', 'dep2': 'dep2'}, validator=validator)
+    assert not errors
+    compiled = list(validator.local.free)
+    assert len(compiled) == 1
+    validated, errors = validate(type_info.schema, {'dep1': 'dep1'}, validator=validator)
+    assert errors
+    assert validator.local.free == compiled
@@ -31,6 +31,12 @@ def test_report_view(workbook, testapp):
     assert 'columns' in res
     assert '@graph' in res
 
+
+def test_search_stats_es_bytes(workbook, testapp):
+    res = testapp.get('/search/?type=Snowball&frame=object')
+    assert 'es_bytes=' in res.headers['X-Stats']
+
+
 # Unit tests
 
 
@@ -412,57 +418,65 @@ def test_set_facets():
     aggs = set_facets(facets, used_filters, principals, doc_types)
 
     expected = {
-        'type': {
+        'facets': {
             'aggs': {
                 'type': {
-                    'terms': {
-                        'field': 'embedded.@type',
-                        'exclude': ['Item'],
-                        'min_doc_count': 0,
-                        'size': 100,
+                    'aggs': {
+                        'type': {
+                            'terms': {
+                                'field': 'embedded.@type',
+                                'exclude': ['Item'],
+                                'min_doc_count': 0,
+                                'size': 100,
+                            },
+                        },
+                    },
+                    'filter': {
+                        'bool': {
+                            'must': [
+                                {'terms': {'audit.foo': ['value2']}},
+                                {'terms': {'embedded.facet1': ['value1']}},
+                            ],
+                            'must_not': []
+                        },
                     },
                 },
-            },
-            'filter': {
-                'bool': {
-                    'must': [
-                        {'terms': {'principals_allowed.view': ['group.admin']}},
-                        {'terms': {'embedded.@type': ['Snowball']}},
-                        {'terms': {'embedded.facet1': ['value1']}},
-                        {'terms': {'audit.foo': ['value2']}},
-                    ],
-                    'must_not': []
-                },
-            },
-        },
-        'audit-foo': {
-            'aggs': {
                 'audit-foo': {
-                    'terms': {
-                        'field': 'audit.foo',
-                        'min_doc_count': 0,
-                        'size': 100,
+                    'aggs': {
+                        'audit-foo': {
+                            'terms': {
+                                'field': 'audit.foo',
+                                'min_doc_count': 0,
+                                'size': 100,
+                            },
+                        },
+                    },
+                    'filter': {
+                        'bool': {
+                            'must': [
+                                {'terms': {'embedded.facet1': ['value1']}},
+                            ],
+                            'must_not': []
+                        },
                     },
                 },
-            },
-            'filter': {
-                'bool': {
-                    'must': [
-                        {'terms': {'principals_allowed.view': ['group.admin']}},
-                        {'terms': {'embedded.@type': ['Snowball']}},
-                        {'terms': {'embedded.facet1': ['value1']}},
-                    ],
-                    'must_not': []
-                },
-            },
-        },
-        'facet1': {
-            'aggs': {
                 'facet1': {
-                    'terms': {
-                        'field': 'embedded.facet1',
-                        'min_doc_count': 0,
-                        'size': 100,
+                    'aggs': {
+                        'facet1': {
+                            'terms': {
+                                'field': 'embedded.facet1',
+                                'min_doc_count': 0,
+                                'size': 100,
+                            },
+                        },
+                    },
+                    'filter': {
+                        'bool': {
+                            'must': [
+                                {'terms': {'audit.foo': ['value2']}},
+                            ],
+                            'must_not': []
+                        },
                     },
                 },
             },
@@ -471,12 +485,11 @@ def test_set_facets():
                     'must': [
                         {'terms': {'principals_allowed.view': ['group.admin']}},
                         {'terms': {'embedded.@type': ['Snowball']}},
-                        {'terms': {'audit.foo': ['value2']}},
                     ],
                     'must_not': []
                 },
             },
-        }
+        },
     }
     assert(expected == aggs)
 
@@ -495,14 +508,19 @@ def test_set_facets_negated_filter():
     aggs = set_facets(facets, used_filters, principals, doc_types)
 
     assert {
-        'facet1': {
+        'facets': {
             'aggs': {
                 'facet1': {
-                    'terms': {
-                        'field': 'embedded.facet1',
-                        'min_doc_count': 0,
-                        'size': 100,
+                    'aggs': {
+                        'facet1': {
+                            'terms': {
+                                'field': 'embedded.facet1',
+                                'min_doc_count': 0,
+                                'size': 100,
+                            },
+                        },
                     },
+                    'filter': {'match_all': {}},
                 },
             },
             'filter': {
@@ -537,60 +555,69 @@ def test_set_facets_type_exists():
     aggs = set_facets(facets, used_filters, principals, doc_types)
 
     assert {
-        'field1': {
+        'facets': {
             'aggs': {
                 'field1': {
-                    'filters': {
-                        'filters': {
-                            'yes': {
-                                'bool': {
-                                    'must': {
-                                        'exists': {'field': 'embedded.field1'}
+                    'aggs': {
+                        'field1': {
+                            'filters': {
+                                'filters': {
+                                    'yes': {
+                                        'bool': {
+                                            'must': {
+                                                'exists': {'field': 'embedded.field1'}
+                                            }
+                                        }
+                                    },
+                                    'no': {
+                                        'bool': {
+                                            'must_not': {
+                                                'exists': {'field': 'embedded.field1'}
+                                            }
+                                        }
                                     }
-                                }
+                                },
                             },
-                            'no': {
-                                'bool': {
-                                    'must_not': {
-                                        'exists': {'field': 'embedded.field1'}
-                                    }
-                                }
-                            }
+                        },
+                    },
+                    'filter': {
+                        'bool': {
+                            'must': [],
+                            'must_not': [
+                                {'exists': {'field': 'embedded.field2'}}
+                            ]
                         },
                     },
                 },
-            },
-            'filter': {
-                'bool': {
-                    'must': [
-                        {'terms': {'principals_allowed.view': ['group.admin']}},
-                        {'terms': {'embedded.@type': ['Snowball']}}
-                    ],
-                    'must_not': [
-                        {'exists': {'field': 'embedded.field2'}}
-                    ]
-                },
-            },
-        },
-        'field2': {
-            'aggs': {
                 'field2': {
-                    'filters': {
-                        'filters': {
-                            'yes': {
-                                'bool': {
-                                    'must': {
-                                        'exists': {'field': 'embedded.field2'}
+                    'aggs': {
+                        'field2': {
+                            'filters': {
+                                'filters': {
+                                    'yes': {
+                                        'bool': {
+                                            'must': {
+                                                'exists': {'field': 'embedded.field2'}
+                                            }
+                                        }
+                                    },
+                                    'no': {
+                                        'bool': {
+                                            'must_not': {
+                                                'exists': {'field': 'embedded.field2'}
+                                            }
+                                        }
                                     }
-                                }
+                                },
                             },
-                            'no': {
-                                'bool': {
-                                    'must_not': {
-                                        'exists': {'field': 'embedded.field2'}
-                                    }
-                                }
-                            }
+                        },
+                    },
+                    'filter': {
+                        'bool': {
+                            'must': [
+                                {'exists': {'field': 'embedded.field1'}},
+                            ],
+                            'must_not': []
                         },
                     },
                 },
@@ -599,8 +626,7 @@ def test_set_facets_type_exists():
                 'bool': {
                     'must': [
                         {'terms': {'principals_allowed.view': ['group.admin']}},
-                        {'terms': {'embedded.@type': ['Snowball']}},
-                        {'exists': {'field': 'embedded.field1'}},
+                        {'terms': {'embedded.@type': ['Snowball']}}
                     ],
                     'must_not': []
                 },
@@ -609,6 +635,47 @@ def test_set_facets_type_exists():
     } == aggs
 
 
+def test_set_facets_reuses_compiled_facets():
+    from snowflakes.search import (
+        _facet_plans,
+        set_facets,
+    )
+    facets = [
+        ('facet1', {'title': 'Facet 1'}),
+    ]
+    set_facets(facets, {'facet1': ['value1']}, ['group.admin'], ['Snowball'])
+    hits = _facet_plans.hits
+    aggs = set_facets(facets, {'facet1': ['value2']}, ['group.admin'], ['Snowball'])
+    assert _facet_plans.hits == hits + 1
+    assert aggs['facets']['aggs']['facet1']['filter'] == {'match_all': {}}
+
+
+def test_format_facets_nested():
+    from snowflakes.search import format_facets
+    es_result = {
+        'aggregations': {
+            'facets': {
+                'doc_count': 3,
+                'field1': {
+                    'field1': {
+                        'buckets': [
+                            {'key': 'value1', 'doc_count': 2},
+                            {'key': 'value2', 'doc_count': 1},
+                        ]
+                    },
+                    'doc_count': 3,
+                },
+            },
+        },
+    }
+    facets = [
+        ('field1', {'title': 'Field 1'}),
+    ]
+    result = format_facets(es_result, facets, {}, [], 42, [])
+    assert [facet['field'] for facet in result] == ['field1']
+    assert result[0]['total'] == 3
+
+
 def test_format_facets():
     from snowflakes.search import format_facets
     es_result = {
@@ -725,3 +792,121 @@ def test_format_facets_adds_pseudo_facet_for_extra_filters():
         ],
         'total': 42,
     }]
+
+
+def test_search_after_sort():
+    from collections import OrderedDict
+    from snowflakes.search import search_after_sort
+    assert search_after_sort({}) == ['_doc', {'_uid': 'asc'}]
+    query = {'sort': OrderedDict((
+        ('embedded.date_created', {'order': 'desc'}),
+        ('embedded.label', {'order': 'asc'}),
+    ))}
+    assert search_after_sort(query) == [
+        {'embedded.date_created': {'order': 'desc'}},
+        {'embedded.label': {'order': 'asc'}},
+        {'_uid': 'asc'},
+    ]
+
+
+def test_iter_search_after():
+    from snowflakes.search import iter_search_after
+
+    def page(start, stop):
+        return {'hits': {'hits': [{'_id': i, 'sort': [i]} for i in range(start, stop)]}}
+
+    class FakeES(object):
+        def __init__(self):
+            self.requests = []
+
+        def search(self, body, index, size):
+            self.requests.append(body['search_after'])
+            start = body['search_after'][0] + 1
+            return page(start, min(start + size, 7))
+
+    es = FakeES()
+    hits = iter_search_after(es, {'sort': []}, 'snowball', page(0, 3), page_size=3)
+    assert [hit['_id'] for hit in hits] == list(range(7))
+    assert es.requests == [[2], [5]]
+
+    es = FakeES()
+    hits = iter_search_after(es, {'sort': []}, 'snowball', page(0, 3), size=4, page_size=3)
+    assert [hit['_id'] for hit in hits] == list(range(4))
+    assert es.requests == [[2]]
+
+
+class FakeTypeInfo(object):
+    def __init__(self, schema):
+        self.schema = schema
+
+
+class FakeRegistry(dict):
+    pass
+
+
+class FakeSearchRequest(FakeRequest):
+    __parent__ = None
+
+    def __init__(self, params, registry):
+        super(FakeSearchRequest, self).__init__(params)
+        self.registry = registry
+
+    def has_permission(self, permission):
+        return False
+
+
+def test_list_result_fields():
+    from snovault import TYPES
+    from snowflakes.search import list_result_fields
+    registry = FakeRegistry({TYPES: {
+        'Snowball': FakeTypeInfo({
+            'properties': {},
+            'columns': {'lab.title': {'title': 'Lab'}},
+        }),
+    }})
+
+    request = FakeSearchRequest((('frame', 'object'),), registry)
+    assert list_result_fields(request, ['Snowball']) == {'object.*'}
+
+    request = FakeSearchRequest((('field', 'lab.name'),), registry)
+    assert list_result_fields(request, ['Snowball']) == {
+        'embedded.@id', 'embedded.@type', 'embedded.lab.name'}
+
+    request = FakeSearchRequest((), registry)
+    assert list_result_fields(request, ['Snowball']) == {
+        'embedded.@id', 'embedded.@type', 'embedded.lab.title'}
+    # default columns are kept per set of types
+    registry[TYPES]['Snowball'].schema['columns'] = {}
+    assert 'embedded.lab.title' in list_result_fields(request, ['Snowball'])
+
+
+@pytest.mark.parametrize('term', ['snow', 'snow ball', 'ENCSR000AAA'])
+def test_translate_search_term_plain(term):
+    from snowflakes.search import translate_search_term
+    assert translate_search_term(term) == term
+
+
+@pytest.mark.parametrize('term, expected', [
+    ('lab:foo', 'lab\\:foo'),
+    ('@type:Snowball', 'embedded.@type:Snowball'),
+    ('snow OR ball', 'snow OR ball'),
+    ('AND', None),
+])
+def test_translate_search_term_parsed(term, expected):
+    from snowflakes.search import translate_search_term
+    assert translate_search_term(term) == expected
+
+
+def test_prepare_search_term_cached():
+    from pyramid.httpexceptions import HTTPBadRequest
+    from snowflakes.search import (
+        prepare_search_term,
+        translate_search_term,
+    )
+    request = FakeRequest((('searchTerm', 'snow:ball'),))
+    query = prepare_search_term(request)
+    hits = translate_search_term.cache_info().hits
+    assert prepare_search_term(request) == query
+    assert translate_search_term.cache_info().hits == hits + 1
+    with pytest.raises(HTTPBadRequest):
+        prepare_search_term(FakeRequest((('searchTerm', 'foo TO'),)))
@@ -124,6 +124,13 @@ def test_abstract_collection(testapp, snowball):
     testapp.get('/snowsets/{accession}'.format(**snowball))
 
 
+def test_upgrade_properties_memoized(testapp, snowball):
+    from urllib.parse import parse_qs
+    res = testapp.get(snowball['@id'])
+    stats = parse_qs(res.headers['X-Stats'])
+    assert int(stats['upgrade_properties_memo_hits'][0]) > 0
+
+
 @pytest.mark.slow
 @pytest.mark.parametrize(('item_type', 'length'), TYPE_LENGTH.items())
 def test_load_workbook(workbook, testapp, item_type, length):
@@ -167,6 +174,14 @@ def test_collection_post_missing_content_type(testapp):
     testapp.post('/award', item, status=415)
 
 
+def test_collection_post_ndjson_only_for_bulk(testapp):
+    item = '{}\n'
+    headers = {'Content-Type': 'application/x-ndjson'}
+    testapp.post('/award', item, status=415, headers=headers)
+    res = testapp.post('/award/@@bulk', item, status=200, headers=headers)
+    assert res.json['@graph'][0]['status'] == 'error'
+
+
 def test_collection_post_bad_(anontestapp):
     from base64 import b64encode
     from pyramid.compat import ascii_native_
@@ -18,7 +18,7 @@ from ..schema_formats import is_accession
 @lru_cache()
 def _award_viewing_group(award_uuid, root):
     award = root.get_by_uuid(award_uuid)
-    return award.upgrade_properties().get('viewing_group')
+    return award.upgrade_properties(copy=False).get('viewing_group')
 
 # Item acls
 
@@ -137,20 +137,20 @@ class Item(snovault.Item):
     def __name__(self):
         if self.name_key is None:
             return self.uuid
-        properties = self.upgrade_properties()
+        properties = self.upgrade_properties(copy=False)
         if properties.get('status') == 'replaced':
             return self.uuid
         return properties.get(self.name_key, None) or self.uuid
 
     def __acl__(self):
         # Don't finalize to avoid validation here.
-        properties = self.upgrade_properties().copy()
+        properties = self.upgrade_properties(copy=False)
         status = properties.get('status')
         return self.STATUS_ACL.get(status, ALLOW_LAB_SUBMITTER_EDIT)
 
     def __ac_local_roles__(self):
         roles = {}
-        properties = self.upgrade_properties().copy()
+        properties = self.upgrade_properties(copy=False)
         if 'lab' in properties:
             lab_submitters = 'submits_for.%s' % properties['lab']
             roles[lab_submitters] = 'role.lab_submitter'
@@ -176,7 +176,7 @@ class SharedItem(Item):
     '''
     def __ac_local_roles__(self):
         roles = {}
-        properties = self.upgrade_properties().copy()
+        properties = self.upgrade_properties(copy=False)
         if 'lab' in properties:
             lab_submitters = 'submits_for.%s' % properties['lab']
             roles[lab_submitters] = 'role.lab_submitter'
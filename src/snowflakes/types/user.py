@@ -155,7 +155,9 @@ def user_add(context,request):
     if pwd is not None:
         del pwd_less_data['password']
 
-    validate_request(context.type_info.schema, request, pwd_less_data)
+    type_info = context.type_info
+    validate_request(type_info.schema, request, pwd_less_data,
+                     validator=type_info.schema_validator)
 
     if request.errors:
         return HTTPUnprocessableEntity(json={'errors':request.errors},